@@ -1,46 +1,355 @@
+import argparse
+import bisect
+import contextlib
+import csv
+import cProfile
 import datetime
+import fnmatch
+import functools
+import glob
+import gzip
+import hashlib
+import importlib.util
+import io
+import ipaddress
+import itertools
 import json
 import os
+import queue
 import re
+import shutil
+import sqlite3
 import sys
-from collections import defaultdict
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+# openpyxl は xlsx を出力するときだけ読み込む (CSV などの出力では import しない)
 
+__version__ = "1.2.0"
+# --incremental のハッシュに含める出力の形式のバージョン。ブックやファイルの内容・書式が変わる
+# 変更では必ず上げる (__version__ はリリースのときだけ上げるので、ハッシュには使わない)
+OUTPUT_FORMAT_VERSION = 1
 
-def parse_attributes(attributes, parent_key=""):
+
+# key: 説明の検索に使う正規化済みのパス (security_rule.destination_port_ranges)
+# indices: パスに含まれるリストのインデックス (3, 0)
+# template: 表示用パスの書式 (security_rule[{}].destination_port_ranges[{}])
+# 大きな state では属性が数千万個になるため、表示用のパス文字列は属性ごとに持たず、
+# intern した template と indices から必要なときだけ組み立てる。値は元の型のまま保持する
+class Attribute:
+    __slots__ = ("template", "value", "key", "indices")
+
+    def __init__(self, template, value, key, indices=()):
+        self.template = template
+        self.value = value
+        self.key = key
+        self.indices = indices
+
+    @property
+    def path(self):
+        # security_rule[3].destination_port_ranges[0]
+        return self.template.format(*self.indices)
+
+    def __repr__(self):
+        return f"Attribute({self.path!r}, {self.value!r})"
+
+
+def _template_segment(key):
+    return key.replace("{", "{{").replace("}", "}}")
+
+
+def parse_attributes(
+    attributes, parent_path="", parent_key="", indices=(), defaults=None
+):
+    # defaults (compact_defaults の結果) を渡すと、空の値と既定値の属性を出力しない
     attribute_list = []
+    _flatten_attributes(
+        attributes,
+        _template_segment(parent_path),
+        parent_key,
+        indices,
+        attribute_list,
+        defaults,
+        {},
+    )
+    return attribute_list
+
+
+def is_omitted(value, key, defaults):
+    if value is None or value == "":
+        return True
+    default = defaults.get(key)
+    if default is None:
+        return False
+    # 説明の既定値は文字列なので、bool や数値は JSON の表記 (false, 30) で比べる
+    return (value if value.__class__ is str else json.dumps(value)) == default
+
+
+def _flatten_attributes(
+    attributes,
+    parent_path,
+    parent_key,
+    indices,
+    attribute_list,
+    defaults=None,
+    shared_indices=None,
+):
+    # パスの書式と正規化済みキーを1回の再帰で同時に組み立てる
+    # shared_indices: 同じインデックスの組 ((0,), (0, 1) など) を1回の呼び出しの全属性で共有する
+    # (プロセス全体では共有しないので、常駐するサーバーのワーカーでも大きくならない)
     for key, value in attributes.items():
+        path = f"{parent_path}{_template_segment(key)}"
+        normalized_key = sys.intern(f"{parent_key}{key}")
         if isinstance(value, dict):
-            attribute_list.extend(
-                parse_attributes(value, f"{parent_key}{key}.")
+            _flatten_attributes(
+                value,
+                f"{path}.",
+                f"{normalized_key}.",
+                indices,
+                attribute_list,
+                defaults,
+                shared_indices,
             )  # Recursive call for nested dictionaries
         elif isinstance(value, list):
+            item_path = sys.intern(f"{path}[{{}}]")
             for i, item in enumerate(value):
+                child = indices + (i,)
+                if shared_indices is not None:
+                    child = shared_indices.setdefault(child, child)
                 if isinstance(item, dict):
-                    attribute_list.extend(
-                        parse_attributes(item, f"{parent_key}{key}[{i}].")
+                    _flatten_attributes(
+                        item,
+                        f"{item_path}.",
+                        f"{normalized_key}.",
+                        child,
+                        attribute_list,
+                        defaults,
+                        shared_indices,
                     )  # Recursive call for nested dictionaries in lists
+                elif defaults is not None and is_omitted(item, normalized_key, {}):
+                    continue
                 else:
                     attribute_list.append(
-                        (f"{parent_key}{key}[{i}]", item)
+                        Attribute(item_path, item, normalized_key, child)
                     )  # Add list item as a separate attribute
+        elif defaults is not None and is_omitted(value, normalized_key, defaults):
+            continue
         else:
             attribute_list.append(
-                (f"{parent_key}{key}", value)
+                Attribute(sys.intern(path), value, normalized_key, indices)
             )  # Add simple key-value pair
-    return attribute_list
+
+
+# tfstate を一度に json.load せず、resources[] を1要素ずつ読み出すためのリーダー
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class _JsonStream:
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Drop the consumed part and read more; the read size grows with the
+        # buffer so that re-decoding a large resource stays linear overall
+        if self.pos:
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        chunk = self.f.read(max(self.chunk_size, len(self.buf)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def _error(self, msg):
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def next_char(self):
+        ch = self.peek()
+        if not ch:
+            raise self._error("Unexpected end of tfstate")
+        self.pos += 1
+        return ch
+
+    def expect(self, expected):
+        if self.next_char() != expected:
+            raise self._error(f"Expecting '{expected}'")
+
+    def value(self):
+        while True:
+            if not self.peek():
+                raise self._error("Unexpected end of tfstate")
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may still be incomplete
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_tfstate_resources(f, resource_filter=None):
+    # resource_filter に一致しないリソースは parse_attributes の前に読み捨てる
+    stream = _JsonStream(f)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "resources":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.next_char()
+            else:
+                while True:
+                    resource = stream.value()
+                    if resource_filter is None or resource_filter.matches(resource):
+                        yield resource  # 1リソースずつ返す
+                    ch = stream.next_char()
+                    if ch == "]":
+                        break
+                    if ch != ",":
+                        raise stream._error("Expecting ',' delimiter")
+        else:
+            stream.value()  # resources 以外 (outputs など) は読み捨てる
+        ch = stream.next_char()
+        if ch == "}":
+            return
+        if ch != ",":
+            raise stream._error("Expecting ',' delimiter")
+
+
+# "-" は標準入力から読む (terraform state pull | azurerm2excel.py - ...)
+STDIN_PATH = "-"
+TFSTATE_SUFFIXES = (".tfstate", ".tfstate.gz", ".tfstate.zst")
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def tfstate_name(tfstate_file):
+    return "<stdin>" if tfstate_file == STDIN_PATH else os.path.abspath(tfstate_file)
+
+
+def is_zstd_tfstate(tfstate_file):
+    # open_tfstate_stream と同じく、拡張子かマジックバイトで判定する (標準入力は読み進めない)
+    if tfstate_file.endswith(".zst"):
+        return True
+    if tfstate_file == STDIN_PATH:
+        head = sys.stdin.buffer.peek(len(ZSTD_MAGIC))
+    else:
+        with open(tfstate_file, "rb") as f:
+            head = f.read(len(ZSTD_MAGIC))
+    return head.startswith(ZSTD_MAGIC)
+
+
+@contextlib.contextmanager
+def open_tfstate(tfstate_file):
+    with contextlib.ExitStack() as stack:
+        if tfstate_file == STDIN_PATH:
+            raw = sys.stdin.buffer
+        else:
+            raw = stack.enter_context(open(tfstate_file, "rb"))
+        with open_tfstate_stream(raw, tfstate_file) as f:
+            yield f
+
+
+@contextlib.contextmanager
+def open_tfstate_stream(raw, tfstate_file=""):
+    # raw: peek できるバイナリストリーム (標準入力、HTTP のリクエストボディなど)
+    # gzip / zstd は拡張子かマジックバイトで判定し、一時ファイルを作らずに展開しながら読む
+    with contextlib.ExitStack() as stack:
+        head = raw.peek(len(ZSTD_MAGIC))[: len(ZSTD_MAGIC)]
+        if head.startswith(GZIP_MAGIC) or tfstate_file.endswith(".gz"):
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode="rb"))
+        elif head.startswith(ZSTD_MAGIC) or tfstate_file.endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError(
+                    f"{tfstate_file} is zstd compressed; pip install zstandard"
+                ) from None
+            raw = stack.enter_context(
+                zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+            )
+        f = io.TextIOWrapper(raw, encoding="utf-8")
+        try:
+            yield f
+        finally:
+            f.detach()  # 元のストリームは閉じない (呼び出し側で閉じる)
+
+
+class ResourceFilter:
+    # リソースタイプ・モジュールアドレス・リソース名の include / exclude
+    # パターンは glob。"re:" で始まる場合は正規表現 (どちらも値全体に一致させる)
+    FIELDS = ("type", "module", "name")
+
+    def __init__(self, include=None, exclude=None):
+        # include / exclude: {"type": [パターン, ...], ...}
+        self.include = self._compile_fields(include or {})
+        self.exclude = self._compile_fields(exclude or {})
+
+    @staticmethod
+    def _compile(patterns):
+        parts = []
+        for pattern in patterns:
+            if pattern.startswith("re:"):
+                parts.append(f"(?:{pattern[3:]})\\Z")
+            else:
+                parts.append(fnmatch.translate(pattern))
+        return re.compile("|".join(parts)).match
+
+    def _compile_fields(self, patterns):
+        return {
+            field: self._compile(patterns[field])
+            for field in self.FIELDS
+            if patterns.get(field)
+        }
+
+    def matches(self, resource):
+        for field, match in self.include.items():
+            if not match(resource.get(field, "")):
+                return False
+        for field, match in self.exclude.items():
+            if match(resource.get(field, "")):
+                return False
+        return True
+
 
 
 def load_descriptions(
-    description_folders,
+    description_folders, resource_types=None
 ):  # description_folder を description_folders に変更
+    # resource_types を指定した場合は、そのタイプの JSON だけを読み込む
     descriptions = {}
     for description_folder in description_folders:  # 各フォルダをループ
         for filename in os.listdir(description_folder):
             if filename.endswith(".json"):
                 type_name = filename.split(".")[0]
+                if resource_types is not None and type_name not in resource_types:
+                    continue
                 with open(
                     os.path.join(description_folder, filename), "r", encoding="utf-8"
                 ) as f:
@@ -48,595 +357,3389 @@ def load_descriptions(
     return descriptions
 
 
-def apply_styles(
-    ws, header_fill, header_font, default_font, left_alignment, thin_border
+DESCRIPTION_INDEX_VERSION = 1
+
+
+def description_folders_signature(description_folders):
+    # フォルダと JSON ファイルの更新日時が変わったらインデックスを作り直す
+    signature = [DESCRIPTION_INDEX_VERSION]
+    for description_folder in description_folders:
+        latest_mtime = os.stat(description_folder).st_mtime_ns
+        count = 0
+        with os.scandir(description_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    count += 1
+                    latest_mtime = max(latest_mtime, entry.stat().st_mtime_ns)
+        signature.append([os.path.abspath(description_folder), latest_mtime, count])
+    return json.dumps(signature)
+
+
+def compile_description_index(description_folders, index_path, signature=None):
+    if signature is None:
+        signature = description_folders_signature(description_folders)
+    descriptions = load_descriptions(description_folders)
+    # 書きかけのインデックスを読まれないよう、一時ファイルに作ってから置き換える
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE descriptions ("
+            "type TEXT, path TEXT, description TEXT, PRIMARY KEY (type, path))"
+        )
+        conn.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+        conn.executemany(
+            "INSERT INTO descriptions VALUES (?, ?, ?)",
+            (
+                (type_name, path, json.dumps(description, ensure_ascii=False))
+                for type_name, type_descriptions in descriptions.items()
+                for path, description in type_descriptions.items()
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+
+
+def read_description_index_signature(index_path):
+    if not os.path.isfile(index_path):
+        return None
+    try:
+        conn = sqlite3.connect(index_path)
+        try:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'signature'"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return None
+    return row[0] if row else None
+
+
+def ensure_description_index(description_folders, index_path):
+    signature = description_folders_signature(description_folders)
+    if read_description_index_signature(index_path) != signature:
+        print(f"Building description index: {index_path}")
+        compile_description_index(description_folders, index_path, signature)
+
+
+def load_descriptions_from_index(
+    description_folders, index_path, resource_types, check_index=True
 ):
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-    for row in ws.iter_rows(min_row=2):  # Skip header row
-        for cell in row:
-            cell.font = default_font
-            cell.alignment = left_alignment
-            cell.border = thin_border
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if cell.value is not None:
-                    lines = str(cell.value).splitlines()
-                    cell_max = max(len(line) for line in lines) if lines else 0
-                    if cell_max > max_length:
-                        max_length = cell_max
-            except:
-                pass
-        adjusted_width = max_length + 2
-        ws.column_dimensions[column].width = adjusted_width
-
-
-def write_to_excel(resources_by_type, descriptions, output_folder):
-    for resource_type, resources in resources_by_type.items():
-        wb = Workbook()
-        for resource in resources:
-            # Limit sheet title to 30 characters
-            sheet_title = resource["name"][:30]
-            ws = wb.create_sheet(title=sheet_title)
-            attribute_list = []
-            for instance in resource["instances"]:
-                attribute_list.extend(parse_attributes(instance["attributes"]))
-
-            # Add header row
-            header = ["Arguments", "Value", "Description"]
-            ws.append(header)
-
-            # Apply background color, font color, and font to the header row
-            header_fill = PatternFill(
-                start_color="0000FF", end_color="0000FF", fill_type="solid"
-            )  # Blue background
-            header_font = Font(
-                color="FFFFFF", name="Yu Gothic UI", bold=True
-            )  # White text, Yu Gothic UI font, bold
-            for cell in ws[1]:
-                cell.fill = header_fill
-                cell.font = header_font
-
-            if resource_type == "azurerm_network_security_group":
-                security_rules = [
-                    attribute
-                    for attribute in attribute_list
-                    if "security_rule" in attribute[0]
-                ]
-                other_attributes = [
-                    attribute
-                    for attribute in attribute_list
-                    # if "security_rule" not in attribute[0]
-                ]
+    if check_index:
+        ensure_description_index(description_folders, index_path)
 
-                # security_ruleだけ別のシートに出力
-                if security_rules:
-                    ws_security_rule = wb.create_sheet(title=f"{sheet_title}_rule")
-                    # Add header row for security_rule sheet
-                    ws_security_rule.append(
-                        [
-                            "rule_index",
-                            "direction",
-                            "priority",
-                            "access",
-                            "name",
-                            "description",
-                            "destination_address_prefix",
-                            "destination_port_range",
-                            "destination_port_ranges",
-                            "protocol",
-                            "source_address_prefix",
-                            "source_port_range",
-                        ]
-                    )
+    descriptions = {}
+    conn = sqlite3.connect(index_path)
+    try:
+        for type_name in resource_types:
+            rows = conn.execute(
+                "SELECT path, description FROM descriptions WHERE type = ?",
+                (type_name,),
+            ).fetchall()
+            if rows:
+                descriptions[type_name] = {
+                    path: json.loads(description) for path, description in rows
+                }
+    finally:
+        conn.close()
+    return descriptions
 
-                    rule_dict = defaultdict(dict)
-                    for rule in security_rules:
-                        rule_key = re.sub(r"\[\d+\]", "", rule[0])
-                        rule_index = re.search(r"\[(\d+)\]", rule[0]).group(1)
-                        if rule_key in rule_dict[rule_index]:
-                            rule_dict[rule_index][rule_key] = str(rule_dict[rule_index][rule_key]) + f"\n{rule[1]}"
-                        else:
-                            rule_dict[rule_index][rule_key] = rule[1]
-
-                    # Sort rules by priority
-                    sorted_rules = sorted(
-                        rule_dict.items(),
-                        key=lambda x: (
-                            x[1].get("security_rule.direction", ""),
-                            int(x[1].get("security_rule.priority", 0)),
-                        ),
-                    )
 
-                    for rule_index, rule_attrs in sorted_rules:
-                        row = [f"security_rule{rule_index}"]
-                        for key in [
-                            "security_rule.direction",
-                            "security_rule.priority",
-                            "security_rule.access",
-                            "security_rule.name",
-                            "security_rule.description",
-                            "security_rule.destination_address_prefix",
-                            "security_rule.destination_port_range",
-                            "security_rule.destination_port_ranges",
-                            "security_rule.protocol",
-                            "security_rule.source_address_prefix",
-                            "security_rule.source_port_range",
-                        ]:
-                            row.append(str(rule_attrs.get(key, "")))
-                        ws_security_rule.append(row)
-
-                    # Apply styles to the new sheet
-                    apply_styles(
-                        ws_security_rule,
-                        header_fill,
-                        header_font,
-                        default_font,
-                        left_alignment,
-                        thin_border,
-                    )
+class DescriptionCache:
+    # 複数の tfstate で説明を共有し、まだ読み込んでいないタイプだけを追加で読み込む
+    def __init__(self, description_folders, description_index=None):
+        self.description_folders = description_folders
+        self.description_index = description_index
+        self.descriptions = {}
+        self.loaded_types = set()
+        self.index_checked = False
 
-                # Add other attributes to the original sheet
-                for attribute in other_attributes:
-                    attribute_path = attribute[0]
-                    normalized_path = re.sub(r"\[\d+\]", "", attribute_path)
-                    description = descriptions.get(resource_type, {}).get(
-                        normalized_path, ""
-                    )
-                    value = str(attribute[1])
-                    ws.append([attribute[0], value, description])
-            elif resource_type == "azurerm_firewall_policy_rule_collection_group":
-                application_rule_collections = [
-                    attribute
-                    for attribute in attribute_list
-                    if "application_rule_collection" in attribute[0]
-                ]
-                network_rule_collections = [
-                    attribute
-                    for attribute in attribute_list
-                    if "network_rule_collection" in attribute[0]
-                ]
-                nat_rule_collections = [
-                    attribute
-                    for attribute in attribute_list
-                    if "nat_rule_collection" in attribute[0]
-                ]
-                other_rule_collections = [
-                    attribute
-                    for attribute in attribute_list
-                    # if "application_rule_collection" not in attribute[0]
-                    # and "network_rule_collection" not in attribute[0]
-                    # and "nat_rule_collection" not in attribute[0]
-                ]
+    def load(self, resource_types):
+        missing = set(resource_types) - self.loaded_types
+        if missing:
+            if self.description_index:
+                loaded = load_descriptions_from_index(
+                    self.description_folders,
+                    self.description_index,
+                    missing,
+                    check_index=not self.index_checked,
+                )
+                self.index_checked = True
+            else:
+                loaded = load_descriptions(self.description_folders, missing)
+            self.descriptions.update(loaded)
+            self.loaded_types |= missing
+        return self.descriptions
 
-                for attribute in other_rule_collections:
-                    attribute_path = attribute[0]
-                    normalized_path = re.sub(r"\[\d+\]", "", attribute_path)
-                    description = descriptions.get(resource_type, {}).get(
-                        normalized_path, ""
-                    )
-                    value = str(attribute[1])
-                    ws.append([attribute[0], value, description])
-                    if attribute[0] == "priority":
-                        collection_group_priority = value
-
-                # application_rule_collectionだけ別のシートに出力
-                if application_rule_collections:
-                    ws_appcol = wb.create_sheet(title=f"apcols_{collection_group_priority}")
-                    # Add header row for collection sheet
-                    ws_appcol.append(
-                        [
-                            "collection_index",
-                            "name",
-                            "priority",
-                            "action",
-                        ]
-                    )
-                    appcol_dict = defaultdict(dict)
-                    appcolrule_dict = defaultdict(dict)
-                    for app_col in application_rule_collections:
-                        app_col_key = re.sub(r"\[\d+\]", "", app_col[0])
-                        app_col_index = re.search(r"\[(\d+)\]", app_col[0]).group(1)
-                        appcol_dict[app_col_index][app_col_key] = app_col[1]
-                        if "rule" in app_col[0]:
-                            match = re.search(r"rule\[(\d+)\]", app_col[0])
-                            if match:
-                                app_col_rule_index = match.group(1)
-                                # グループキー：col_index_ruleIndex
-                                key = f"{app_col_index}_{app_col_rule_index}"
-                                if key in appcolrule_dict:
-                                    appcolrule_dict[key][app_col_key] = str(
-                                        appcolrule_dict[key].get(app_col_key, "")
-                                    ) + f"\n{app_col[1]}"
-                                else:
-                                    appcolrule_dict[key][app_col_key] = app_col[1]
-                    sorted_appcols = sorted(
-                        appcol_dict.items(),
-                        key=lambda x: int(x[1].get("application_rule_collection.priority", 0)),
+
+class DescriptionLookup(dict):
+    # 正規化済みパス -> 説明。説明のないパスは最も長い親ブロックの説明を使う
+    # (security_rule.destination_port_ranges -> security_rule)
+    # 解決した結果は dict 自身にキャッシュするので、2回目以降は1回の dict の参照で済む
+    __slots__ = ("descriptions",)
+
+    def __init__(self, descriptions):
+        super().__init__()
+        self.descriptions = descriptions
+
+    def __missing__(self, key):
+        path = key
+        description = self.descriptions.get(path)
+        while not description:
+            path, dot, _ = path.rpartition(".")
+            if not dot:
+                description = ""
+                break
+            description = self.descriptions.get(path)
+        self[key] = description
+        return description
+
+
+# --compact defaults: 説明に書かれた既定値 ("Defaults to `false`." など)
+COMPACT_MODES = ("empty", "defaults")
+DEFAULT_VALUE_PATTERN = re.compile(
+    r"\bdefaults? (?:value )?(?:to|is) `([^`]*)`|(?:既定値|デフォルト値?)は\s*`([^`]*)`",
+    re.IGNORECASE,
+)
+
+
+def compact_defaults(type_descriptions, compact=None):
+    # compact が None なら None (全属性を出力)、それ以外は属性のキー -> 既定値の文字列
+    if not compact:
+        return None
+    defaults = {}
+    if compact == "defaults":
+        if isinstance(type_descriptions, DescriptionLookup):
+            type_descriptions = type_descriptions.descriptions
+        for key, description in type_descriptions.items():
+            match = DEFAULT_VALUE_PATTERN.search(str(description))
+            if match:
+                default = match.group(1)
+                if default is None:
+                    default = match.group(2)
+                defaults[key] = default.strip().strip("\"'")
+    return defaults
+
+
+def description_lookup(type_descriptions):
+    # タイプの説明ごとに1回だけ作り、リソースをまたいでキャッシュを使い回す
+    if isinstance(type_descriptions, DescriptionLookup):
+        return type_descriptions
+    return DescriptionLookup(type_descriptions)
+
+
+HEADER_STYLE = "azurerm2excel_header"
+BODY_STYLE = "azurerm2excel_body"
+
+
+def create_named_styles():
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+    thin_border = Border(
+        left=Side(style="thin"),
+        right=Side(style="thin"),
+        top=Side(style="thin"),
+        bottom=Side(style="thin"),
+    )
+    header_style = NamedStyle(
+        name=HEADER_STYLE,
+        fill=PatternFill(
+            start_color="0000FF", end_color="0000FF", fill_type="solid"
+        ),  # Blue background
+        font=Font(
+            color="FFFFFF", name="Yu Gothic UI", bold=True
+        ),  # White text, Yu Gothic UI font, bold
+        border=thin_border,
+    )
+    body_style = NamedStyle(
+        name=BODY_STYLE,
+        font=Font(name="Yu Gothic UI"),
+        alignment=Alignment(
+            horizontal="left", vertical="top", wrap_text=True
+        ),  # Left alignment with text wrapping and top alignment
+        border=thin_border,
+    )
+    return header_style, body_style
+
+
+# 同じプロセスで作るブックでは同じ NamedStyle を使い回す (openpyxl の組み込みスタイルと同じく、
+# add_named_style で追加先のブックに結び付け直される)
+@functools.lru_cache(maxsize=None)
+def named_styles():
+    return create_named_styles()
+
+
+def column_number(column):
+    # "A" -> 1, "AA" -> 27
+    number = 0
+    for ch in column.upper():
+        number = number * 26 + ord(ch) - ord("A") + 1
+    return number
+
+
+def text_width(text):
+    if "\n" not in text:
+        return len(text)
+    return max((len(line) for line in text.splitlines()), default=0)
+
+
+# Excel の上限 (1シートの行数、1セルの文字数)
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_CELL_CHARS = 32767
+SHEET_TITLE_LENGTH = 31
+
+# max_sheet_rows: 1シートの行数 (見出しを含む)。超えた行は続きのシート "title (2)" へ
+# max_workbook_rows: 1ブックの行数の目安。超えたらリソースの区切りで次のブックへ (None: 無制限)
+# max_workbook_bytes: 作成中のブックのメモリの見積もりの上限 (--max-memory から決める)
+# compresslevel: ZIP の圧縮レベル (0: 無圧縮、1-9、None: zlib の既定値)
+# rule_analysis: NSG とファイアウォールポリシーのルールの分析シートを出力する
+# compact: 出力しない属性 (None: すべて出力、"empty": 空の値、"defaults": 空の値と既定値)
+WorkbookOptions = namedtuple(
+    "WorkbookOptions",
+    [
+        "max_sheet_rows",
+        "max_workbook_rows",
+        "max_workbook_bytes",
+        "compresslevel",
+        "rule_analysis",
+        "compact",
+    ],
+    defaults=(None, None, False, None),
+)
+DEFAULT_WORKBOOK_OPTIONS = WorkbookOptions(EXCEL_MAX_ROWS, None)
+
+# 作成中のブックのメモリの目安 (バイト)。溜めた1行と、openpyxl が出力時に作る1シートあたり
+WORKBOOK_ROW_BYTES = 512
+WORKBOOK_SHEET_BYTES = 64 * 1024
+
+
+def workbook_is_full(rows, sheets, options):
+    if options.max_workbook_rows and rows >= options.max_workbook_rows:
+        return True
+    if options.max_workbook_bytes:
+        estimated_bytes = rows * WORKBOOK_ROW_BYTES + sheets * WORKBOOK_SHEET_BYTES
+        return estimated_bytes >= options.max_workbook_bytes
+    return False
+
+
+def is_split_by_size(options):
+    return bool(options.max_workbook_rows or options.max_workbook_bytes)
+
+
+class SheetTitles:
+    # 1冊のブックのシート名。openpyxl と同じく大文字小文字を区別せずに重複を避け、
+    # 末尾に番号を付ける (this, this1, this2, ...)。ハイパーリンクはここで決めた名前を使う
+    def __init__(self, reserved=()):
+        self.used = {title.lower() for title in reserved}
+        self.numbers = {}
+
+    def allocate(self, title):
+        key = title.lower()
+        if key not in self.used:
+            self.used.add(key)
+            return title
+        number = self.numbers.get(key, 0)
+        while True:
+            number += 1
+            suffix = str(number)
+            candidate = title[: SHEET_TITLE_LENGTH - len(suffix)] + suffix
+            if candidate.lower() not in self.used:
+                break
+        self.numbers[key] = number
+        self.used.add(candidate.lower())
+        return candidate
+
+
+def split_text(text, limit=EXCEL_MAX_CELL_CHARS):
+    # 改行の位置で limit 文字以内の塊に分ける。limit を超える1行は途中で切る
+    chunks = []
+    lines = []
+    size = -1
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if lines:
+                chunks.append("\n".join(lines))
+                lines, size = [], -1
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if lines and size + 1 + len(line) > limit:
+            chunks.append("\n".join(lines))
+            lines, size = [], -1
+        lines.append(line)
+        size += 1 + len(line)
+    chunks.append("\n".join(lines))
+    return chunks
+
+
+def split_row(row, limit=EXCEL_MAX_CELL_CHARS):
+    # 長すぎるセルを複数行に分ける。2行目以降は分割したセルだけに値を入れる
+    columns = [
+        split_text(value, limit) if isinstance(value, str) else [value]
+        for value in row
+    ]
+    rows = []
+    for line in range(max(len(chunks) for chunks in columns)):
+        rows.append(
+            [
+                chunks[line] if line < len(chunks) else None
+                for chunks in columns
+            ]
+        )
+    for column, chunks in enumerate(columns):
+        if len(chunks) == 1:
+            for continued in rows[1:]:
+                continued[column] = None
+    return rows
+
+
+class LinkedValue:
+    # ハイパーリンク付きのセルの値
+    # workbook: リンク先のブックのファイル名 (None なら同じブック)、sheet: リンク先のシート
+    __slots__ = ("value", "workbook", "sheet")
+
+    def __init__(self, value, workbook, sheet):
+        self.value = value
+        self.workbook = workbook
+        self.sheet = sheet
+
+    def __str__(self):
+        return str(self.value)
+
+
+class SheetBuffer:
+    # 行を溜めながら列幅を計測し、書き込み時にスタイル済みセルとして一括出力する
+    def __init__(self, title, fixed_widths=None, workbook=None, max_rows=EXCEL_MAX_ROWS):
+        self.title = title
+        self.renamed_from = None  # 重複のため番号を付けた場合の元の名前
+        self.fixed_widths = fixed_widths or {}
+        # 固定幅の列は計測しない
+        self.fixed_columns = {
+            column_number(column) - 1 for column in self.fixed_widths
+        }
+        self.workbook = workbook
+        self.max_rows = max_rows
+        self.current = self  # 行を追加中のシート (上限を超えると続きのシートになる)
+        self.parts = 1
+        self.split_rows = 0  # 長すぎる値を分割した行の数
+        self.rows = []
+        self.widths = []
+        self.cells = 0
+
+    def append(self, row):
+        # 上限は書き込みながら確認する (溜めた後で分割しない)
+        for value in row:
+            if isinstance(value, str) and len(value) > EXCEL_MAX_CELL_CHARS:
+                self.split_rows += 1
+                for part in split_row(row):
+                    self._append(part)
+                return
+        self._append(row)
+
+    def _append(self, row):
+        sheet = self.current
+        if len(sheet.rows) >= self.max_rows and self.workbook is not None:
+            sheet = self.current = self.workbook.continue_sheet(self)
+        sheet.add_row(row)
+
+    def add_row(self, row):
+        self.cells += len(row)
+        widths = self.widths
+        if len(widths) < len(row):
+            widths.extend([0] * (len(row) - len(widths)))
+        for idx, value in enumerate(row):
+            if value is None or idx in self.fixed_columns:
+                continue
+            width = text_width(str(value))
+            if width > widths[idx]:
+                widths[idx] = width
+        self.rows.append(row)
+        if self.workbook is not None:
+            self.workbook.rows += 1
+
+    def write(self, wb):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+        from openpyxl.worksheet.hyperlink import Hyperlink
+
+        ws = wb.create_sheet(title=self.title)
+        # write-only シートでは列幅を最初の行より前に設定する必要がある
+        for idx, width in enumerate(self.widths, start=1):
+            column = get_column_letter(idx)
+            ws.column_dimensions[column].width = self.fixed_widths.get(
+                column, width + 2
+            )
+        for row_number, row in enumerate(self.rows):
+            style = HEADER_STYLE if row_number == 0 else BODY_STYLE
+            cells = []
+            for value in row:
+                if value.__class__ is LinkedValue:
+                    cell = WriteOnlyCell(ws, value=value.value)
+                    sheet = value.sheet.replace("'", "''")
+                    cell.hyperlink = Hyperlink(
+                        ref="", target=value.workbook, location=f"'{sheet}'!A1"
                     )
-                    for app_col_index, app_col_attrs in sorted_appcols:
-                        row = [f"apcol{app_col_index}"]
-                        for key in [
-                            "application_rule_collection.name",
-                            "application_rule_collection.priority",
-                            "application_rule_collection.action",
-                        ]:
-                            row.append(str(app_col_attrs.get(key, "")))
-                        ws_appcol.append(row)
-
-                    # apruleシートをcol_indexごとに分ける
-                    app_rule_sheets = {}
-                    for rule_key, rule_attrs in appcolrule_dict.items():
-                        ap_col_index, ap_rule_index = rule_key.split("_", 1)
-                        if ap_col_index not in app_rule_sheets:
-                            # collectionのpriorityを取得してシート名に含める
-                            priority = appcol_dict[ap_col_index].get("application_rule_collection.priority", "0")
-                            app_rule_sheets[ap_col_index] = wb.create_sheet(title=f"apcol_{collection_group_priority}_{priority}_rules")
-                            app_rule_sheets[ap_col_index].append(
-                                [
-                                    "rule_Index",
-                                    "name",
-                                    "description",
-                                    "destination_addresses",
-                                    "destination_fqdn_tags",
-                                    "destination_fqdns",
-                                    "destination_urls",
-                                    "http_headers",
-                                    "protocols",
-                                    "source_addresses",
-                                    "source_ip_groups",
-                                    "terminate_tls",
-                                    "web_categories",
-                                ]
-                            )
-                        row = [f"aprule{ap_rule_index}".strip()]
-                        for key in [
-                            "application_rule_collection.rule.name",
-                            "application_rule_collection.rule.description",
-                            "application_rule_collection.rule.destination_addresses",
-                            "application_rule_collection.rule.destination_fqdn_tags",
-                            "application_rule_collection.rule.destination_fqdns",
-                            "application_rule_collection.rule.destination_urls",
-                            "application_rule_collection.rule.http_headers",
-                            "application_rule_collection.rule.protocols",
-                            "application_rule_collection.rule.source_addresses",
-                            "application_rule_collection.rule.source_ip_groups",
-                            "application_rule_collection.rule.terminate_tls",
-                            "application_rule_collection.rule.web_categories",
-                        ]:
-                            if key == "application_rule_collection.rule.protocols":
-                                ports = str(rule_attrs.get("application_rule_collection.rule.protocols.port", "")).split("\n")
-                                types = str(rule_attrs.get("application_rule_collection.rule.protocols.type", "")).split("\n")
-                                protocols = [f"{t}:{p}" for p, t in zip(ports, types) if p.strip() or t.strip()]
-                                row.append("\n".join(protocols))
-                            else:
-                                row.append(str(rule_attrs.get(key, "")).strip())
-                        app_rule_sheets[ap_col_index].append(row)
-
-                    apply_styles(
-                        ws_appcol,
-                        header_fill,
-                        header_font,
-                        default_font,
-                        left_alignment,
-                        thin_border,
+                else:
+                    cell = WriteOnlyCell(ws, value=value)
+                cell.style = style
+                cells.append(cell)
+            ws.append(cells)
+        return ws
+
+
+class WorkbookBuffer:
+    # filename: 保存先のファイル名 (同じブックへのリンクの判定に使う)
+    # reserved_titles: リソースのシートに使うため、ほかのシートには付けない名前
+    def __init__(
+        self, max_sheet_rows=EXCEL_MAX_ROWS, filename=None, reserved_titles=()
+    ):
+        self.max_sheet_rows = max_sheet_rows
+        self.filename = filename
+        self.titles = SheetTitles(reserved_titles)
+        self.sheets = []
+        self.rows = 0  # 全シートの行数 (SheetBuffer.add_row で数える)
+        self.resource_titles = []  # リソースのシート名 (リソースの順)
+
+    def create_sheet(self, title, fixed_widths=None, reserved=False):
+        # reserved: reserved_titles で予約済みの名前をそのまま使う
+        unique_title = title if reserved else self.titles.allocate(title)
+        sheet = SheetBuffer(unique_title, fixed_widths, self, self.max_sheet_rows)
+        if unique_title != title:
+            sheet.renamed_from = title
+        self.sheets.append(sheet)
+        return sheet
+
+    def continue_sheet(self, sheet):
+        # 続きのシートは元のシートの直後に置き、見出し行を繰り返す
+        sheet.parts += 1
+        suffix = f" ({sheet.parts})"
+        title = sheet.title[: SHEET_TITLE_LENGTH - len(suffix)] + suffix
+        continuation = SheetBuffer(
+            self.titles.allocate(title), sheet.fixed_widths, self, self.max_sheet_rows
+        )
+        self.sheets.insert(self.sheets.index(sheet.current) + 1, continuation)
+        if sheet.rows:
+            continuation.add_row(sheet.rows[0])
+        return continuation
+
+    def is_full(self, options):
+        return workbook_is_full(self.rows, len(self.sheets), options)
+
+    def render(self):
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        for style in named_styles():
+            wb.add_named_style(style)
+        for sheet in self.sheets:
+            sheet.write(wb)
+        return wb
+
+    def save(self, output_path):
+        self.render().save(output_path)
+
+
+# ネストしたブロックを別シートに展開するテーブル定義
+# block: 展開するブロック (親テーブルからの相対パス、リストであること)
+# sheet: シート名 ({sheet_title}, {resource[キー]}, {parent[キー]} が使える)
+# label: 行ラベル ({index} はブロックのインデックス)
+# header: 見出し行 (先頭は行ラベルの列)
+# columns: ブロック内の相対キー。(書式, キーのタプル) は複数のキーを1列にまとめる
+# sort: 並べ替えキー [(キー, 型)]。指定しない場合は tfstate の順
+# strip: 値の前後の空白を除去する
+# children: 行ごとに別シートへ展開する子テーブル
+NESTED_TABLES = {
+    "azurerm_network_security_group": [
+        {
+            "block": "security_rule",
+            "sheet": "{sheet_title}_rule",
+            "label": "security_rule{index}",
+            "header": [
+                "rule_index",
+                "direction",
+                "priority",
+                "access",
+                "name",
+                "description",
+                "destination_address_prefix",
+                "destination_port_range",
+                "destination_port_ranges",
+                "protocol",
+                "source_address_prefix",
+                "source_port_range",
+            ],
+            "columns": [
+                "direction",
+                "priority",
+                "access",
+                "name",
+                "description",
+                "destination_address_prefix",
+                "destination_port_range",
+                "destination_port_ranges",
+                "protocol",
+                "source_address_prefix",
+                "source_port_range",
+            ],
+            "sort": [("direction", str), ("priority", int)],
+        },
+    ],
+    "azurerm_firewall_policy_rule_collection_group": [
+        {
+            "block": "application_rule_collection",
+            "sheet": "apcols_{resource[priority]}",
+            "label": "apcol{index}",
+            "header": ["collection_index", "name", "priority", "action"],
+            "columns": ["name", "priority", "action"],
+            "sort": [("priority", int)],
+            "children": [
+                {
+                    "block": "rule",
+                    "sheet": "apcol_{resource[priority]}_{parent[priority]}_rules",
+                    "label": "aprule{index}",
+                    "header": [
+                        "rule_Index",
+                        "name",
+                        "description",
+                        "destination_addresses",
+                        "destination_fqdn_tags",
+                        "destination_fqdns",
+                        "destination_urls",
+                        "http_headers",
+                        "protocols",
+                        "source_addresses",
+                        "source_ip_groups",
+                        "terminate_tls",
+                        "web_categories",
+                    ],
+                    "columns": [
+                        "name",
+                        "description",
+                        "destination_addresses",
+                        "destination_fqdn_tags",
+                        "destination_fqdns",
+                        "destination_urls",
+                        "http_headers",
+                        ("{0}:{1}", ("protocols.type", "protocols.port")),
+                        "source_addresses",
+                        "source_ip_groups",
+                        "terminate_tls",
+                        "web_categories",
+                    ],
+                    "strip": True,
+                },
+            ],
+        },
+        {
+            "block": "network_rule_collection",
+            "sheet": "netcols_{resource[priority]}",
+            "label": "netcol{index}",
+            "header": ["collection_index", "name", "priority", "action"],
+            "columns": ["name", "priority", "action"],
+            "sort": [("priority", int)],
+            "children": [
+                {
+                    "block": "rule",
+                    "sheet": "netcol_{resource[priority]}_{parent[priority]}_rules",
+                    "label": "netrule{index}",
+                    "header": [
+                        "rule_Index",
+                        "name",
+                        "description",
+                        "destination_addresses",
+                        "destination_fqdns",
+                        "destination_ip_groups",
+                        "destination_ports",
+                        "protocols",
+                        "source_addresses",
+                        "source_ip_groups",
+                    ],
+                    "columns": [
+                        "name",
+                        "description",
+                        "destination_addresses",
+                        "destination_fqdns",
+                        "destination_ip_groups",
+                        "destination_ports",
+                        "protocols",
+                        "source_addresses",
+                        "source_ip_groups",
+                    ],
+                    "strip": True,
+                },
+            ],
+        },
+        {
+            "block": "nat_rule_collection",
+            "sheet": "natcols_{resource[priority]}",
+            "label": "natcol{index}",
+            "header": ["collection_index", "name", "priority", "action"],
+            "columns": ["name", "priority", "action"],
+            "sort": [("priority", int)],
+            "children": [
+                {
+                    "block": "rule",
+                    "sheet": "natcol_{resource[priority]}_{parent[priority]}_rules",
+                    "label": "natrule{index}",
+                    "header": [
+                        "rule_index",
+                        "name",
+                        "description",
+                        "destination_address",
+                        "destination_ports",
+                        "protocols",
+                        "source_addresses",
+                        "source_ip_groups",
+                        "translated_address",
+                        "translated_fqdn",
+                        "translated_port",
+                    ],
+                    "columns": [
+                        "name",
+                        "description",
+                        "destination_address",
+                        "destination_ports",
+                        "protocols",
+                        "source_addresses",
+                        "source_ip_groups",
+                        "translated_address",
+                        "translated_fqdn",
+                        "translated_port",
+                    ],
+                    "strip": True,
+                },
+            ],
+        },
+    ],
+    "azurerm_route_table": [
+        {
+            "block": "route",
+            "sheet": "{sheet_title}_route",
+            "label": "route{index}",
+            "header": [
+                "route_index",
+                "name",
+                "address_prefix",
+                "next_hop_type",
+                "next_hop_in_ip_address",
+            ],
+            "columns": [
+                "name",
+                "address_prefix",
+                "next_hop_type",
+                "next_hop_in_ip_address",
+            ],
+        },
+    ],
+}
+
+
+class NestedRow:
+    __slots__ = ("values", "children")
+
+    def __init__(self):
+        self.values = defaultdict(list)  # 相対キー -> 値のリスト (出力時に1回だけ連結する)
+        self.children = defaultdict(dict)  # 子ブロック -> {インデックス: NestedRow}
+
+
+def join_values(values, strip=False):
+    text = "\n".join([str(value) for value in values])
+    return text.strip() if strip else text
+
+
+def route_attribute(table, rows, attribute):
+    # 属性を1回の走査でテーブル (と子テーブル) の行に振り分ける
+    rest = attribute.key.partition(".")[2]
+    indices = attribute.indices
+    depth = 0
+    while depth < len(indices):
+        row = rows.get(indices[depth])
+        if row is None:
+            row = rows[indices[depth]] = NestedRow()
+        head, _, child_rest = rest.partition(".")
+        child = table.get("child_routes", {}).get(head) if child_rest else None
+        if child is None:
+            row.values[rest].append(attribute.value)
+            return
+        table, rows, rest = child, row.children[head], child_rest
+        depth += 1
+
+
+def render_nested_row(table, row):
+    strip = table.get("strip", False)
+    cells = []
+    for column in table["columns"]:
+        if isinstance(column, tuple):
+            template, keys = column
+            parts = []
+            for combo in zip(*(row.values.get(key, ()) for key in keys)):
+                texts = [str(value) for value in combo]
+                if any(text.strip() for text in texts):
+                    parts.append(template.format(*texts))
+            cells.append("\n".join(parts))
+        else:
+            cells.append(join_values(row.values.get(column, ()), strip))
+    return cells
+
+
+def nested_sort_key(table):
+    sort = table["sort"]
+
+    def key(item):
+        values = item[1].values
+        sort_key = []
+        for column, kind in sort:
+            column_values = values.get(column)
+            sort_key.append(kind(column_values[0]) if column_values else kind())
+        return tuple(sort_key)
+
+    return key
+
+
+def write_nested_table(wb, table, rows, context):
+    ws = wb.create_sheet(title=table["sheet"].format(**context))
+    ws.append(table["header"])
+    items = rows.items()
+    if "sort" in table:
+        items = sorted(items, key=nested_sort_key(table))
+    label = table["label"]
+    for index, row in items:
+        ws.append([label.format(index=index)] + render_nested_row(table, row))
+
+    # 子テーブルは親の行ごとに別シートへ出力する
+    for child in table.get("children", ()):
+        for row in rows.values():
+            child_rows = row.children.get(child["block"])
+            if child_rows:
+                parent = defaultdict(str)
+                for key, values in row.values.items():
+                    parent[key] = join_values(values)
+                write_nested_table(wb, child, child_rows, dict(context, parent=parent))
+
+
+def compile_nested_tables(tables):
+    compiled = []
+    for table in tables:
+        table = dict(table)
+        children = compile_nested_tables(table.get("children", ()))
+        table["children"] = children
+        table["child_routes"] = {child["block"]: child for child in children}
+        compiled.append(table)
+    return compiled
+
+
+COMPILED_NESTED_TABLES = {
+    resource_type: compile_nested_tables(tables)
+    for resource_type, tables in NESTED_TABLES.items()
+}
+
+
+def write_nested_tables(wb, tables, attribute_list, sheet_title):
+    routes = {table["block"]: (table, {}) for table in tables}
+    resource_values = defaultdict(str)  # トップレベルの値 (シート名に使う)
+    for attribute in attribute_list:
+        head, _, rest = attribute.key.partition(".")
+        route = routes.get(head) if rest else None
+        if route is not None:
+            route_attribute(route[0], route[1], attribute)
+        elif not rest and not attribute.indices:
+            resource_values[head] = attribute.value
+
+    context = {"sheet_title": sheet_title, "resource": resource_values}
+    for table, rows in routes.values():
+        if rows:
+            write_nested_table(wb, table, rows, context)
+    return {block: rows for block, (table, rows) in routes.items()}
+
+
+# NSG とファイアウォールポリシーのルールの分析 (シャドウ・重複・重なり)
+# ルールを条件 (プロトコル、送信元・宛先のアドレスとポート) の直積として扱い、
+# 優先順位の高いルールに完全に含まれるルール (shadowed)、条件が同じルール (duplicate)、
+# アクションの異なるルールと一部が重なるルール (overlapping) を探す
+# アドレス (IPv4 / IPv6) とポートは区間、サービスタグや IP グループなどは文字列として比較する
+PORT_RANGES = ((0, 65535),)
+# IPv6 は IPv4 の後ろに並べて1つの数直線で扱う
+IPV6_OFFSET = 1 << 32
+ADDRESS_RANGES = ((0, IPV6_OFFSET - 1), (IPV6_OFFSET, IPV6_OFFSET + (1 << 128) - 1))
+RULE_WILDCARDS = {"*", "any"}
+
+# wildcard: "*" / "Any" (すべてに一致)、intervals: 結合済みの区間、tokens: その他の値
+RuleValues = namedtuple("RuleValues", ["wildcard", "intervals", "tokens"])
+# fields: 条件ごとの RuleValues。同じ fields のルールは重複
+# options: 一致する通信は変えないが動作を変える設定 (terminate_tls など)。
+# fields が同じでも options が異なるルールは重複ではなく shadowed とする
+Rule = namedtuple(
+    "Rule",
+    ["label", "group", "priority", "name", "action", "fields", "options"],
+    defaults=((),),
+)
+
+
+# 同じアドレスは多くのルールに繰り返し現れるので、解析結果をキャッシュする
+@functools.lru_cache(maxsize=65536)
+def parse_address_interval(text):
+    # よく使う IPv4 のアドレスと CIDR は ipaddress を使わずに解析する
+    address, slash, length = text.partition("/")
+    octets = address.split(".")
+    if (
+        len(octets) == 4
+        and all(octet.isdecimal() and int(octet) < 256 for octet in octets)
+        and (length.isdecimal() and int(length) <= 32 if slash else True)
+    ):
+        value = 0
+        for octet in octets:
+            value = value << 8 | int(octet)
+        host = (1 << (32 - int(length or 32))) - 1
+        return value & ~host, value | host
+    try:
+        if "-" in text:
+            first, last = (
+                ipaddress.ip_address(part.strip()) for part in text.split("-", 1)
+            )
+            if first.version != last.version:
+                return None
+        else:
+            network = ipaddress.ip_network(text, strict=False)
+            first, last = network.network_address, network.broadcast_address
+    except ValueError:
+        return None
+    offset = 0 if first.version == 4 else IPV6_OFFSET
+    return int(first) + offset, int(last) + offset
+
+
+def parse_port_interval(text):
+    low, _, high = text.partition("-")
+    if not low.strip().isdigit() or (high and not high.strip().isdigit()):
+        return None
+    return int(low), int(high or low)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+
+def rule_values(values, parse=None, universe=()):
+    wildcard = False
+    intervals = []
+    tokens = set()
+    for value in values:
+        if value is None:
+            continue
+        text = str(value).strip()
+        if not text:
+            continue
+        if text.lower() in RULE_WILDCARDS:
+            wildcard = True
+            continue
+        interval = parse(text) if parse else None
+        if interval is None:
+            tokens.add(text.lower())
+        else:
+            intervals.append(interval)
+    # 指定のない条件はすべてに一致する
+    if wildcard or not (intervals or tokens):
+        return RuleValues(True, merge_intervals(universe), frozenset())
+    return RuleValues(False, merge_intervals(intervals), frozenset(tokens))
+
+
+class IntervalIndex:
+    # 全ルールの区間を始点の順に並べ、部分木ごとに終点の最大値と最小値を持つ
+    # ルールの区間は結合済みなので、範囲 [low, high] を覆うルールは low より前から high まで届く区間か
+    # 始点が low で終点が high 以上の区間を、範囲に重なるルールは low より前から low まで届く区間か
+    # 始点が low から high までの区間を持つルール。始点の範囲は二分探索で、届く区間は木で求める
+    # ルールのビットマスクは MASK_LEAVES 個以上の区間の部分木だけに持つ
+    # (メモリは区間の数 × ルールの数ではなく、区間の数 / MASK_LEAVES × ルールの数に比例する)
+    MASK_LEAVES = 64
+
+    def __init__(self, rule_intervals):
+        entries = sorted(
+            (low, high, position)
+            for position, intervals in enumerate(rule_intervals)
+            for low, high in intervals
+        )
+        self.starts = [low for low, _, _ in entries]
+        self.ends = [high for _, high, _ in entries]
+        self.positions = [position for _, _, position in entries]
+        # 先頭から i 番目までの区間の終点の最大値 (届く区間がなければ木を調べない)
+        self.reach = list(itertools.accumulate(self.ends, max))
+        size = self.size = 1 << max(len(entries) - 1, 0).bit_length()
+        # 空きの葉は max_end が -1 なので調べない
+        self.max_end = max_end = [-1] * (2 * size)
+        self.min_end = min_end = [-1] * (2 * size)
+        max_end[size : size + len(entries)] = self.ends
+        min_end[size : size + len(entries)] = self.ends
+        for node in range(size - 1, 0, -1):
+            max_end[node] = max(max_end[2 * node], max_end[2 * node + 1])
+            min_end[node] = min(min_end[2 * node], min_end[2 * node + 1])
+        # node < len(masks) の部分木 (葉が MASK_LEAVES 個以上) のルールのビットマスク
+        masks = self.masks = [0] * (2 * size // self.MASK_LEAVES)
+        for node in range(len(masks) - 1, 0, -1):
+            if 2 * node < len(masks):
+                masks[node] = masks[2 * node] | masks[2 * node + 1]
+            else:
+                masks[node] = self._leaves(node)
+
+    def _leaves(self, node):
+        # 部分木のすべての区間のルール
+        shift = self.size.bit_length() - node.bit_length()
+        leaf = (node << shift) - self.size
+        mask = 0
+        for position in self.positions[leaf : leaf + (1 << shift)]:
+            mask |= 1 << position
+        return mask
+
+    def _subtrees(self, first, last):
+        # first から last - 1 番目までの区間を覆う部分木
+        first += self.size
+        last += self.size
+        while first < last:
+            if first & 1:
+                yield first
+                first += 1
+            if last & 1:
+                last -= 1
+                yield last
+            first >>= 1
+            last >>= 1
+
+    def _range(self, first, last):
+        masks = self.masks
+        mask = 0
+        for node in self._subtrees(first, last):
+            mask |= masks[node] if node < len(masks) else self._leaves(node)
+        return mask
+
+    def _reaching(self, count, threshold):
+        # 先頭の count 個の区間のうち、終点が threshold 以上の区間を持つルール
+        if not count or self.reach[count - 1] < threshold:
+            return 0
+        max_end = self.max_end
+        min_end = self.min_end
+        masks = self.masks
+        nodes = [node for node in self._subtrees(0, count) if max_end[node] >= threshold]
+        mask = 0
+        while nodes:
+            node = nodes.pop()
+            if min_end[node] >= threshold:
+                mask |= masks[node] if node < len(masks) else self._leaves(node)
+                continue
+            for child in (2 * node, 2 * node + 1):
+                if max_end[child] >= threshold:
+                    nodes.append(child)
+        return mask
+
+    def covering(self, low, high):
+        starts = self.starts
+        first = bisect.bisect_left(starts, low)
+        last = bisect.bisect_right(starts, low, first)
+        # 始点が low の区間は終点の順に並んでいる
+        same_start = bisect.bisect_left(self.ends, high, first, last)
+        return self._reaching(first, high) | self._range(same_start, last)
+
+    def overlapping(self, low, high):
+        starts = self.starts
+        first = bisect.bisect_left(starts, low)
+        last = bisect.bisect_right(starts, high, first)
+        return self._reaching(first, low) | self._range(first, last)
+
+
+class RuleFieldIndex:
+    # 1つの条件について、candidates のうち値を含む (覆う) ルールと値に重なるルールのビットマスクを返す
+    # (候補がなくなった、またはすべて見つかった時点で残りの値を調べない)
+    def __init__(self, values_list):
+        self.wildcard = 0
+        self.tokens = defaultdict(int)
+        for position, values in enumerate(values_list):
+            bit = 1 << position
+            if values.wildcard:
+                self.wildcard |= bit
+            for token in values.tokens:
+                self.tokens[token] |= bit
+        self.intervals = IntervalIndex([values.intervals for values in values_list])
+
+    def covering(self, values, candidates):
+        if values.wildcard:
+            return candidates & self.wildcard
+        mask = candidates
+        for token in values.tokens:
+            mask &= self.wildcard | self.tokens.get(token, 0)
+        for low, high in values.intervals:
+            if not mask:
+                break
+            mask &= self.intervals.covering(low, high)
+        return mask
+
+    def overlapping(self, values, candidates):
+        if values.wildcard:
+            return candidates
+        mask = candidates & self.wildcard
+        for token in values.tokens:
+            mask |= candidates & self.tokens.get(token, 0)
+        for low, high in values.intervals:
+            if mask == candidates:
+                break
+            mask |= candidates & self.intervals.overlapping(low, high)
+        return mask
+
+
+def analyze_rules(rules):
+    # rules は評価順 (優先順位の高い順)。ルールごとに先に評価されるルールとの関係を1つ返す
+    # (状態, 関係するルールのうち最も優先順位の高いもの, 関係するルールの数)
+    if not rules:
+        return []
+    field_indexes = [
+        RuleFieldIndex([rule.fields[i] for rule in rules])
+        for i in range(len(rules[0].fields))
+    ]
+    action_masks = defaultdict(int)
+    for position, rule in enumerate(rules):
+        action_masks[rule.action.lower()] |= 1 << position
+
+    findings = []
+    first_rules = {}
+    for position, rule in enumerate(rules):
+        earlier = (1 << position) - 1
+        first = first_rules.setdefault((rule.fields, rule.options), rule)
+        if first is not rule:
+            findings.append((rule, "duplicate", first, 1))
+            continue
+        covering = earlier
+        for index, values in zip(field_indexes, rule.fields):
+            covering = index.covering(values, covering)
+            if not covering:
+                break
+        if covering:
+            related = rules[(covering & -covering).bit_length() - 1]
+            findings.append((rule, "shadowed", related, covering.bit_count()))
+            continue
+        # 重なりはアクションが異なる場合だけ (同じアクションなら評価順は結果に影響しない)
+        overlapping = earlier & ~action_masks[rule.action.lower()]
+        for index, values in zip(field_indexes, rule.fields):
+            overlapping = index.overlapping(values, overlapping)
+            if not overlapping:
+                break
+        if overlapping:
+            related = rules[(overlapping & -overlapping).bit_length() - 1]
+            findings.append((rule, "overlapping", related, overlapping.bit_count()))
+    return findings
+
+
+def row_values(row, *keys):
+    return [value for key in keys for value in row.values.get(key, ())]
+
+
+def first_value(row, key, default=""):
+    values = row.values.get(key)
+    return values[0] if values and values[0] is not None else default
+
+
+def nsg_rules(nested_rows):
+    # security_rule を方向ごとに優先度順に並べる
+    rules = defaultdict(list)
+    for index, row in nested_rows.get("security_rule", {}).items():
+        direction = first_value(row, "direction")
+        fields = (
+            rule_values(row_values(row, "protocol")),
+            rule_values(
+                row_values(
+                    row,
+                    "source_address_prefix",
+                    "source_address_prefixes",
+                    "source_application_security_group_ids",
+                ),
+                parse_address_interval,
+                ADDRESS_RANGES,
+            ),
+            rule_values(
+                row_values(row, "source_port_range", "source_port_ranges"),
+                parse_port_interval,
+                PORT_RANGES,
+            ),
+            rule_values(
+                row_values(
+                    row,
+                    "destination_address_prefix",
+                    "destination_address_prefixes",
+                    "destination_application_security_group_ids",
+                ),
+                parse_address_interval,
+                ADDRESS_RANGES,
+            ),
+            rule_values(
+                row_values(row, "destination_port_range", "destination_port_ranges"),
+                parse_port_interval,
+                PORT_RANGES,
+            ),
+        )
+        rules[direction].append(
+            Rule(
+                f"security_rule{index}",
+                direction,
+                int(first_value(row, "priority", 0)),
+                first_value(row, "name"),
+                str(first_value(row, "access")),
+                fields,
+            )
+        )
+    for group in rules.values():
+        group.sort(key=lambda rule: rule.priority)
+    return rules
+
+
+def firewall_policy_rules(nested_rows):
+    # ルールコレクションの優先度順、コレクション内は tfstate の順に評価する
+    # ネットワークルールとアプリケーションルールはそれぞれの中で比較する
+    rules = defaultdict(list)
+    for block, group, label in (
+        ("network_rule_collection", "network", "netcol{0}.netrule{1}"),
+        ("application_rule_collection", "application", "apcol{0}.aprule{1}"),
+    ):
+        for collection_index, collection in nested_rows.get(block, {}).items():
+            priority = int(first_value(collection, "priority", 0))
+            for index, row in collection.children.get("rule", {}).items():
+                options = ()
+                if group == "network":
+                    fields = (
+                        rule_values(row_values(row, "protocols")),
+                        rule_values(
+                            row_values(row, "source_addresses", "source_ip_groups"),
+                            parse_address_interval,
+                            ADDRESS_RANGES,
+                        ),
+                        rule_values(
+                            row_values(
+                                row,
+                                "destination_addresses",
+                                "destination_ip_groups",
+                                "destination_fqdns",
+                            ),
+                            parse_address_interval,
+                            ADDRESS_RANGES,
+                        ),
+                        rule_values(
+                            row_values(row, "destination_ports"),
+                            parse_port_interval,
+                            PORT_RANGES,
+                        ),
                     )
-                    for sheet in app_rule_sheets.values():
-                        apply_styles(
-                            sheet,
-                            header_fill,
-                            header_font,
-                            default_font,
-                            left_alignment,
-                            thin_border,
+                else:
+                    protocols = [
+                        f"{protocol_type}:{port}"
+                        for protocol_type, port in zip(
+                            row_values(row, "protocols.type"),
+                            row_values(row, "protocols.port"),
                         )
-                    # -------------------------------------------------------
-
-                # network_rule_collectionだけ別のシートに出力
-                if network_rule_collections:
-                    ws_netcol = wb.create_sheet(title=f"netcols_{collection_group_priority}")
-                    # Add header row for network_rule_collection sheet
-                    ws_netcol.append(
-                        [
-                            "collection_index",
-                            "name",
-                            "priority",
-                            "action",
-                        ]
-                    )
-                    netcol_dict = defaultdict(dict)
-                    netcolrule_dict = defaultdict(dict)
-                    for net_col in network_rule_collections:
-                        net_col_key = re.sub(r"\[\d+\]", "", net_col[0])
-                        net_col_index = re.search(r"\[(\d+)\]", net_col[0]).group(1)
-                        netcol_dict[net_col_index][net_col_key] = net_col[1]
-                        if "rule" in net_col[0]:
-                            match = re.search(r"rule\[(\d+)\]", net_col[0])
-                            if match:
-                                net_col_rule_index = match.group(1)
-                                key = f"{net_col_index}_{net_col_rule_index}"
-                                if key in netcolrule_dict:
-                                    netcolrule_dict[key][net_col_key] = str(netcolrule_dict[key].get(net_col_key, "")) + f"\n{net_col[1]}"
-                                else:
-                                    netcolrule_dict[key][net_col_key] = net_col[1]
-                    # Sort net_cols by priority
-                    sorted_netcols = sorted(
-                        netcol_dict.items(),
-                        key=lambda x: int(x[1].get("network_rule_collection.priority", 0)),
+                    ]
+                    fields = (
+                        rule_values(protocols),
+                        rule_values(
+                            row_values(row, "source_addresses", "source_ip_groups"),
+                            parse_address_interval,
+                            ADDRESS_RANGES,
+                        ),
+                        rule_values(
+                            row_values(
+                                row,
+                                "destination_addresses",
+                                "destination_fqdns",
+                                "destination_fqdn_tags",
+                                "destination_urls",
+                                "web_categories",
+                            ),
+                            parse_address_interval,
+                            ADDRESS_RANGES,
+                        ),
                     )
-                    for net_col_index, net_col_attrs in sorted_netcols:
-                        row = [f"netcol{net_col_index}"]
-                        for key in [
-                            "network_rule_collection.name",
-                            "network_rule_collection.priority",
-                            "network_rule_collection.action",
-                        ]:
-                            row.append(str(net_col_attrs.get(key, "")))
-                        ws_netcol.append(row)
-                    
-                    # ----- 変更箇所: net_ruleシートを個別に作成する -----
-                    net_rule_sheets = {}
-                    for net_key, net_attrs in netcolrule_dict.items():
-                        net_col_index, net_rule_index = net_key.split("_", 1)
-                        if net_col_index not in net_rule_sheets:
-                            priority = netcol_dict[net_col_index].get("network_rule_collection.priority", "0")
-                            net_rule_sheets[net_col_index] = wb.create_sheet(title=f"netcol_{collection_group_priority}_{priority}_rules")
-                            net_rule_sheets[net_col_index].append(
-                                [
-                                    "rule_Index",
-                                    "name",
-                                    "description",
-                                    "destination_addresses",
-                                    "destination_fqdns",
-                                    "destination_ip_groups",
-                                    "destination_ports",
-                                    "protocols",
-                                    "source_addresses",
-                                    "source_ip_groups",
-                                ]
+                    options = (
+                        str(first_value(row, "terminate_tls", False)).lower(),
+                        tuple(
+                            sorted(
+                                zip(
+                                    map(str, row_values(row, "http_headers.name")),
+                                    map(str, row_values(row, "http_headers.value")),
+                                )
                             )
-                        row = [f"netrule{net_rule_index}".strip()]
-                        for key in [
-                            "network_rule_collection.rule.name",
-                            "network_rule_collection.rule.description",
-                            "network_rule_collection.rule.destination_addresses",
-                            "network_rule_collection.rule.destination_fqdns",
-                            "network_rule_collection.rule.destination_ip_groups",
-                            "network_rule_collection.rule.destination_ports",
-                            "network_rule_collection.rule.protocols",
-                            "network_rule_collection.rule.source_addresses",
-                            "network_rule_collection.rule.source_ip_groups",
-                        ]:
-                            row.append(str(net_attrs.get(key, "")).strip())
-                        net_rule_sheets[net_col_index].append(row)
-                    
-                    apply_styles(
-                        ws_netcol,
-                        header_fill,
-                        header_font,
-                        default_font,
-                        left_alignment,
-                        thin_border,
-                    )
-                    for sheet in net_rule_sheets.values():
-                        apply_styles(
-                            sheet,
-                            header_fill,
-                            header_font,
-                            default_font,
-                            left_alignment,
-                            thin_border,
-                        )
-                    # -------------------------------------------------------
-
-                # nat_rule_collectionだけ別のシートに出力
-                if nat_rule_collections:
-                    ws_natcol = wb.create_sheet(title=f"natcols_{collection_group_priority}")
-                    # Add header row for nat_rule_collection sheet
-                    ws_natcol.append(
-                        [
-                            "collection_index",
-                            "name",
-                            "priority",
-                            "action",
-                        ]
-                    )
-                    natcol_dict = defaultdict(dict)
-                    natcolrule_dict = defaultdict(dict)
-                    for nat_col in nat_rule_collections:
-                        nat_col_key = re.sub(r"\[\d+\]", "", nat_col[0])
-                        nat_col_index = re.search(r"\[(\d+)\]", nat_col[0]).group(1)
-                        natcol_dict[nat_col_index][nat_col_key] = nat_col[1]
-                        if "rule" in nat_col[0]:
-                            match = re.search(r"rule\[(\d+)\]", nat_col[0])
-                            if match:
-                                nat_col_rule_index = match.group(1)
-                                key = f"{nat_col_index}_{nat_col_rule_index}"
-                                if key in natcolrule_dict:
-                                    natcolrule_dict[key][nat_col_key] = str(natcolrule_dict[key].get(nat_col_key, "")) + f"\n{nat_col[1]}"
-                                else:
-                                    natcolrule_dict[key][nat_col_key] = nat_col[1]
-                    # Sort nat_cols by priority
-                    sorted_natcols = sorted(
-                        natcol_dict.items(),
-                        key=lambda x: int(x[1].get("nat_rule_collection.priority", 0)),
+                        ),
                     )
-                    for nat_col_index, nat_col_attrs in sorted_natcols:
-                        row = [f"natcol{nat_col_index}"]
-                        for key in [
-                            "nat_rule_collection.name",
-                            "nat_rule_collection.priority",
-                            "nat_rule_collection.action",
-                        ]:
-                            row.append(str(nat_col_attrs.get(key, "")))
-                        ws_natcol.append(row)
-                    
-                    # ----- 変更箇所: nat_ruleシートを個別に作成する -----
-                    nat_rule_sheets = {}
-                    for nat_key, nat_attrs in natcolrule_dict.items():
-                        nat_col_index, nat_rule_index = nat_key.split("_", 1)
-                        if nat_col_index not in nat_rule_sheets:
-                            priority = natcol_dict[nat_col_index].get("nat_rule_collection.priority", "0")
-                            nat_rule_sheets[nat_col_index] = wb.create_sheet(title=f"natcol_{collection_group_priority}_{priority}_rules")
-                            nat_rule_sheets[nat_col_index].append(
-                                [
-                                    "rule_index",
-                                    "name",
-                                    "description",
-                                    "destination_address",
-                                    "destination_ports",
-                                    "protocols",
-                                    "source_addresses",
-                                    "source_ip_groups",
-                                    "translated_address",
-                                    "translated_fqdn",
-                                    "translated_port",
-                                ]
-                            )
-                        row = [f"natrule{nat_rule_index}".strip()]
-                        for key in [
-                            "nat_rule_collection.rule.name",
-                            "nat_rule_collection.rule.description",
-                            "nat_rule_collection.rule.destination_address",
-                            "nat_rule_collection.rule.destination_ports",
-                            "nat_rule_collection.rule.protocols",
-                            "nat_rule_collection.rule.source_addresses",
-                            "nat_rule_collection.rule.source_ip_groups",
-                            "nat_rule_collection.rule.translated_address",
-                            "nat_rule_collection.rule.translated_fqdn",
-                            "nat_rule_collection.rule.translated_port",
-                        ]:
-                            row.append(str(nat_attrs.get(key, "")).strip())
-                        nat_rule_sheets[nat_col_index].append(row)
-                    apply_styles(
-                        ws_natcol,
-                        header_fill,
-                        header_font,
-                        default_font,
-                        left_alignment,
-                        thin_border,
+                rules[group].append(
+                    Rule(
+                        label.format(collection_index, index),
+                        group,
+                        priority,
+                        f"{first_value(collection, 'name')}/{first_value(row, 'name')}",
+                        str(first_value(collection, "action")),
+                        fields,
+                        options,
                     )
-                    for sheet in nat_rule_sheets.values():
-                        apply_styles(
-                            sheet,
-                            header_fill,
-                            header_font,
-                            default_font,
-                            left_alignment,
-                            thin_border,
-                        )
-                    # -------------------------------------------------------
+                )
+    for group in rules.values():
+        group.sort(key=lambda rule: rule.priority)  # 安定ソートでコレクション内の順を保つ
+    return rules
 
-            else:
-                for attribute in attribute_list:
-                    attribute_path = attribute[0]
-                    normalized_path = re.sub(r"\[\d+\]", "", attribute_path)
-                    description = descriptions.get(resource_type, {}).get(
-                        normalized_path, ""
-                    )
-                    value = str(attribute[1])
-                    ws.append([attribute[0], value, description])
-
-            # Apply font and alignment to all other cells
-            default_font = Font(name="Yu Gothic UI")
-            left_alignment = Alignment(
-                horizontal="left", vertical="top", wrap_text=True
-            )  # Left alignment with text wrapping and top alignment
-            for row in ws.iter_rows(min_row=2):  # Skip header row
-                for cell in row:
-                    cell.font = default_font
-                    cell.alignment = left_alignment
-
-            # Apply border to all cells
-            thin_border = Border(
-                left=Side(style="thin"),
-                right=Side(style="thin"),
-                top=Side(style="thin"),
-                bottom=Side(style="thin"),
+
+RULE_ANALYSES = {
+    "azurerm_network_security_group": nsg_rules,
+    "azurerm_firewall_policy_rule_collection_group": firewall_policy_rules,
+}
+
+RULE_ANALYSIS_HEADER = [
+    "rule",
+    "group",
+    "priority",
+    "name",
+    "action",
+    "status",
+    "related_rule",
+    "related_priority",
+    "related_name",
+    "related_action",
+    "related_rules",
+]
+
+
+def write_rule_analysis(wb, rules_by_group, sheet_title):
+    # 指摘のあるルールだけを出力する (指摘がなければシートを作らない)
+    rows = []
+    for group, rules in rules_by_group.items():
+        for rule, status, related, count in analyze_rules(rules):
+            rows.append(
+                [
+                    rule.label,
+                    group,
+                    rule.priority,
+                    rule.name,
+                    rule.action,
+                    status,
+                    related.label,
+                    related.priority,
+                    related.name,
+                    related.action,
+                    count,
+                ]
             )
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.border = thin_border
-
-            # Adjust column widths
-            ws.column_dimensions["B"].width = 100  # Set width for Value column
-            ws.column_dimensions["C"].width = 100  # Set width for Description column
-
-            # Adjust column widths for non-B,C columns
-            for col in ws.columns:
-                max_length = 0
-                column = col[0].column_letter  # Get the column name
-                if column not in ["B", "C"]:  # Skip Value and Description columns
-                    for cell in col:
-                        try:
-                            if cell.value is not None:
-                                lines = str(cell.value).splitlines()
-                                cell_max = max(len(line) for line in lines) if lines else 0
-                                if cell_max > max_length:
-                                    max_length = cell_max
-                        except:
-                            pass
-                    adjusted_width = max_length + 2
-                    ws.column_dimensions[column].width = adjusted_width
-
-        # Remove the default sheet created by openpyxl
-        if "Sheet" in wb.sheetnames:
-            wb.remove(wb["Sheet"])
-
-        output_path = os.path.join(output_folder, f"{resource_type}.xlsx")
-        wb.save(output_path)
-        print(f"Excel file saved to {output_path}")
-
-
-def process_tfstate(tfstate_file, description_folders, output_folder):
-    with open(tfstate_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if rows:
+        suffix = "_analysis"
+        title = sheet_title[: SHEET_TITLE_LENGTH - len(suffix)] + suffix
+        ws = wb.create_sheet(title=title)
+        ws.append(RULE_ANALYSIS_HEADER)
+        for row in rows:
+            ws.append(row)
 
-    resources_by_type = defaultdict(list)
-    for res in data["resources"]:
-        if res["mode"] == "managed":
-            resources_by_type[res["type"]].append(res)
 
-    descriptions = load_descriptions(description_folders)
-    write_to_excel(resources_by_type, descriptions, output_folder)
+def flatten_resource(resource, defaults=None):
+    attribute_list = []
+    for instance in resource["instances"]:
+        attribute_list.extend(
+            parse_attributes(instance["attributes"], defaults=defaults)
+        )
+    return attribute_list
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:  # 引数の数を変更
-        print(
-            "Usage: python azurerm2excel.py <path_to_tfstate_file> <description_folder1> [<description_folder2> ...]"
-        )  # メッセージを変更
-        sys.exit(1)
+def resource_sheet_title(resource):
+    # Limit sheet title to 30 characters
+    return resource["name"][:30]
 
-    tfstate_file = sys.argv[1]
-    description_folders = sys.argv[
-        2:
-    ]  # description_folder を description_folders に変更
-    output_folder = "output"  # 固定の出力フォルダ
 
-    if not os.path.isfile(tfstate_file):
-        print(f"Error: The file {tfstate_file} does not exist。")
-        sys.exit(1)
+class ResourceIndex:
+    # --link-ids: tfstate の読み込み中に作る、リソースの ID の索引とタイプごとの参照
+    # ワーカーには、タイプが参照している ID のリンク先 (link_targets) だけを渡す
+    def __init__(self):
+        # ID (小文字) -> (リソースタイプ, タイプ内の順番, 表示名)。ARM の ID は大文字小文字を区別しない
+        self.ids = {}
+        # リソースタイプ -> 属性の値に現れた "/" で始まる文字列 (小文字)
+        self.references = defaultdict(set)
 
-    for description_folder in description_folders:  # 各フォルダをチェック
-        if not os.path.isdir(description_folder):
-            print(f"Error: The directory {description_folder} does not exist。")
-            sys.exit(1)
+    def add(self, resource, position):
+        references = self.references[resource["type"]]
+        for instance in resource["instances"]:
+            attributes = instance.get("attributes") or {}
+            resource_id = attributes.get("id")
+            if isinstance(resource_id, str) and resource_id:
+                address = resource_address(resource, instance)
+                name = attributes.get("name")
+                self.ids[resource_id.lower()] = (
+                    resource["type"],
+                    position,
+                    f"{address} ({name})" if isinstance(name, str) and name else address,
+                )
+            # 自身の id 以外の値を集める (add_resource_sheets がリンクにする値と同じ)
+            values = [value for key, value in attributes.items() if key != "id"]
+            while values:
+                value = values.pop()
+                if value.__class__ is str:
+                    if value[:1] == "/":
+                        references.add(value.lower())
+                elif value.__class__ is dict:
+                    values.extend(value.values())
+                elif value.__class__ is list:
+                    values.extend(value)
 
-    # フォルダが存在しない場合は作成する
-    if not os.path.isdir(output_folder):
-        print(f"Creating output folder: {output_folder}")
-        os.makedirs(output_folder)
+    def link_targets(self, resource_type, layouts):
+        # タイプが参照している ID -> (リンク先のブックのファイル名, シート名, 表示名)
+        # リンク先のブックとシートは、タイプごとの配置 (WorkbookLayouts) から求める
+        targets = {}
+        for resource_id in self.references.get(resource_type, ()):
+            target = self.ids.get(resource_id)
+            if target is None:
+                continue
+            target_type, position, reference = target
+            part, sheet_title = layouts[target_type][position]
+            targets[resource_id] = (
+                workbook_filename(target_type, part),
+                sheet_title,
+                reference,
+            )
+        return targets
 
-    # YYYYMMDDss フォルダを作成
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    output_folder = os.path.join(output_folder, timestamp)
-    os.makedirs(output_folder)
 
-    process_tfstate(
-        tfstate_file, description_folders, output_folder
+def add_resource_sheets(
+    wb,
+    resource_type,
+    resource,
+    attribute_list,
+    type_descriptions,
+    id_index=None,
+    rule_analysis=False,
+    sheet_title=None,
+):
+    # sheet_title: layout_resource_type で決めたシート名 (None ならここで重複を避けて付ける)
+    title = resource_sheet_title(resource)
+    describe = description_lookup(type_descriptions)
+    # Value and Description columns have a fixed width
+    ws = wb.create_sheet(
+        title=sheet_title or title,
+        fixed_widths={"B": 100, "C": 100},
+        reserved=sheet_title is not None,
+    )
+    if ws.title != title:
+        ws.renamed_from = title
+    sheet_title = ws.title
+
+    # Add header row
+    header = ["Arguments", "Value", "Description"]
+    if id_index is None:
+        ws.append(header)
+        for attribute in attribute_list:
+            description = describe[attribute.key]
+            value = str(attribute.value)
+            ws.append([attribute.path, value, description])
+    else:
+        # 他のリソースの ID はリンク先のシートへのハイパーリンクにし、参照先の名前を添える
+        ws.append(header + ["Reference"])
+        for attribute in attribute_list:
+            description = describe[attribute.key]
+            value = attribute.value
+            target = None
+            if value.__class__ is str and value[:1] == "/" and attribute.key != "id":
+                target = id_index.get(value.lower())
+            if target is None:
+                ws.append([attribute.path, str(value), description])
+                continue
+            target_workbook, target_sheet, reference = target
+            workbook = None if target_workbook == wb.filename else target_workbook
+            ws.append(
+                [
+                    attribute.path,
+                    LinkedValue(value, workbook, target_sheet),
+                    description,
+                    LinkedValue(reference, workbook, target_sheet),
+                ]
+            )
+
+    # security_rule などのネストしたブロックは別のシートに出力
+    nested_tables = COMPILED_NESTED_TABLES.get(resource_type)
+    if nested_tables:
+        nested_rows = write_nested_tables(
+            wb, nested_tables, attribute_list, sheet_title
+        )
+        if rule_analysis and resource_type in RULE_ANALYSES:
+            rules = RULE_ANALYSES[resource_type](nested_rows)
+            write_rule_analysis(wb, rules, sheet_title)
+    return sheet_title
+
+
+def layout_resource_type(
+    resource_type,
+    resources,
+    type_descriptions,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+):
+    # リソースごとの (ブックの番号, シート名)。build_resource_workbooks はこのとおりに出力するので、
+    # ほかのタイプからのリンクや一覧は、出力の前にリンク先のブックとシートを知ることができる
+    # 1冊に収まる場合、シート名はリソースの順に決め、ネストしたブロックなどのシートより優先する
+    split = is_split_by_size(workbook_options)
+    layout = []
+    part = 1
+    titles = SheetTitles()
+    if not split:
+        for resource in resources:
+            layout.append((part, titles.allocate(resource_sheet_title(resource))))
+        return layout
+    # ブックの区切りはリソースごとの行数とシート数で決まるので、1リソースずつ組み立てて数える
+    # (組み立てたシートはすぐに捨てる。行数はリンクの有無やシート名によらない)
+    # シート名もブックごとに組み立てた順に決めるので、layout を渡さずに分割した場合と同じになる
+    defaults = compact_defaults(type_descriptions, workbook_options.compact)
+    type_descriptions = description_lookup(type_descriptions)
+    rows = sheets = 0
+    for resource in resources:
+        if sheets and workbook_is_full(rows, sheets, workbook_options):
+            part += 1
+            rows = sheets = 0
+            titles = SheetTitles()
+        wb = WorkbookBuffer(workbook_options.max_sheet_rows)
+        wb.titles = titles  # 同じブックのリソースとシート名を共有する
+        sheet_title = add_resource_sheets(
+            wb,
+            resource_type,
+            resource,
+            flatten_resource(resource, defaults),
+            type_descriptions,
+            rule_analysis=workbook_options.rule_analysis,
+        )
+        rows += wb.rows
+        sheets += len(wb.sheets)
+        layout.append((part, sheet_title))
+    return layout
+
+
+class WorkbookLayouts(dict):
+    # リソースタイプ -> layout_resource_type の結果。リンク先などで必要になったタイプだけ求める
+    def __init__(
+        self, resources_by_type, descriptions, workbook_options=DEFAULT_WORKBOOK_OPTIONS
+    ):
+        super().__init__()
+        self.resources_by_type = resources_by_type
+        self.descriptions = descriptions
+        self.workbook_options = workbook_options
+
+    def __missing__(self, resource_type):
+        layout = self[resource_type] = layout_resource_type(
+            resource_type,
+            self.resources_by_type[resource_type],
+            self.descriptions.get(resource_type, {}),
+            self.workbook_options,
+        )
+        return layout
+
+
+def build_resource_workbooks(
+    resource_type,
+    resources,
+    type_descriptions,
+    timings=None,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    id_index=None,
+    layout=None,
+):
+    # 行数 (またはメモリの見積もり) が上限を超えたら、リソースの区切りで次のブックに分ける
+    # layout を渡した場合は、その区切りとシート名で出力する
+    if timings is None:
+        timings = {}
+    timings.setdefault("flatten", 0.0)
+    timings.setdefault("build", 0.0)
+    if layout is None and not is_split_by_size(workbook_options):
+        # 1冊に収まる場合は、シート名を決めるだけなので先に求める
+        layout = layout_resource_type(
+            resource_type, resources, type_descriptions, workbook_options
+        )
+    reserved_titles = defaultdict(list)
+    for part, sheet_title in layout or ():
+        reserved_titles[part].append(sheet_title)
+
+    def new_workbook(part):
+        return WorkbookBuffer(
+            workbook_options.max_sheet_rows,
+            workbook_filename(resource_type, part),
+            reserved_titles[part],
+        )
+
+    defaults = compact_defaults(type_descriptions, workbook_options.compact)
+    type_descriptions = description_lookup(type_descriptions)
+    part = 1
+    wb = new_workbook(part)
+    for position, resource in enumerate(resources):
+        sheet_title = None
+        if layout is not None:
+            resource_part, sheet_title = layout[position]
+            if resource_part != part:
+                yield wb
+                part = resource_part
+                wb = new_workbook(part)
+        elif wb.sheets and wb.is_full(workbook_options):
+            yield wb
+            part += 1
+            wb = new_workbook(part)
+        start = time.perf_counter()
+        attribute_list = flatten_resource(resource, defaults)
+        flattened = time.perf_counter()
+        sheet_title = add_resource_sheets(
+            wb,
+            resource_type,
+            resource,
+            attribute_list,
+            type_descriptions,
+            id_index,
+            workbook_options.rule_analysis,
+            sheet_title,
+        )
+        wb.resource_titles.append(sheet_title)
+        timings["flatten"] += flattened - start
+        timings["build"] += time.perf_counter() - flattened
+    yield wb
+
+
+def workbook_filename(resource_type, part=1):
+    # 2冊目以降は azurerm_foo_2.xlsx のように番号を付ける
+    name = resource_type if part == 1 else f"{resource_type}_{part}"
+    return f"{name}.xlsx"
+
+
+def workbook_path(output_folder, resource_type, part=1):
+    return os.path.join(output_folder, workbook_filename(resource_type, part))
+
+
+def workbook_parts(output_folder, resource_type):
+    paths = [workbook_path(output_folder, resource_type)]
+    while os.path.isfile(workbook_path(output_folder, resource_type, len(paths) + 1)):
+        paths.append(workbook_path(output_folder, resource_type, len(paths) + 1))
+    return paths
+
+
+def write_resource_workbook(
+    resource_type,
+    resources,
+    type_descriptions,
+    output_folder,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    id_index=None,
+    layout=None,
+    saver=None,
+):
+    # 出力先と、ステージごとの処理時間・件数を返す (ワーカープロセスからも返せる)
+    # saver を渡した場合は保存を待たずに返すので、finish_saved で保存の完了を待つ
+    timings = {"flatten": 0.0, "build": 0.0, "style": 0.0, "save": 0.0}
+    output_paths = []
+    sheet_layout = []  # 出力したリソースごとの (ブックの番号, シート名)
+    saves = []
+    sheets = rows = cells = 0
+    own_saver = saver is None
+    if own_saver:
+        saver = WorkbookSaver()
+    workbooks = build_resource_workbooks(
+        resource_type,
+        resources,
+        type_descriptions,
+        timings,
+        workbook_options,
+        id_index,
+        layout,
+    )
+    try:
+        for part, wb in enumerate(workbooks, start=1):
+            output_path = workbook_path(output_folder, resource_type, part)
+            start = time.perf_counter()
+            workbook = wb.render()
+            timings["style"] += time.perf_counter() - start
+            # 分割したブックは、保存している間に次のブックを作成する
+            saves.append(
+                saver.submit(workbook, output_path, workbook_options.compresslevel)
+            )
+            output_paths.append(output_path)
+            sheet_layout.extend((part, title) for title in wb.resource_titles)
+            sheets += len(wb.sheets)
+            rows += wb.rows
+            cells += sum(sheet.cells for sheet in wb.sheets)
+    finally:
+        if own_saver:
+            saver.close()
+    result = {
+        "resource_type": resource_type,
+        "format": "xlsx",
+        "output_path": output_paths[0],
+        "output_paths": output_paths,
+        "layout": sheet_layout,
+        "resources": len(resources),
+        "sheets": sheets,
+        "rows": rows,
+        "cells": cells,
+        "timings": timings,
+        "saves": saves,
+    }
+    if own_saver:
+        return finish_saved(result)
+    return result
+
+
+def save_workbook(workbook, output_path, compresslevel=None):
+    # openpyxl の Workbook.save と同じだが、ZIP の圧縮レベルを指定できる (0 は無圧縮)
+    from openpyxl.writer.excel import ExcelWriter
+
+    if workbook.write_only and not workbook.worksheets:
+        workbook.create_sheet()
+    if compresslevel == 0:
+        archive = zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED, allowZip64=True)
+    else:
+        archive = zipfile.ZipFile(
+            output_path,
+            "w",
+            zipfile.ZIP_DEFLATED,
+            allowZip64=True,
+            compresslevel=compresslevel,
+        )
+    workbook.properties.modified = datetime.datetime.now(
+        tz=datetime.timezone.utc
+    ).replace(tzinfo=None)
+    ExcelWriter(workbook, archive).save()
+
+
+# 保存を待っているブックの数の上限 (超えたらブックの作成側が待つ)
+SAVE_QUEUE_SIZE = 2
+
+
+class WorkbookSaver:
+    # 出力の終わったブックの保存 (ZIP への書き出しと圧縮) を別スレッドで行い、
+    # 次のブックの作成と重ねる。submit は保存にかかった秒数を返す Future を返す
+    def __init__(self, queue_size=SAVE_QUEUE_SIZE):
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, workbook, output_path, compresslevel=None):
+        future = Future()
+        self.queue.put((workbook, output_path, compresslevel, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            workbook, output_path, compresslevel, future = item
+            start = time.perf_counter()
+            try:
+                save_workbook(workbook, output_path, compresslevel)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(time.perf_counter() - start)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def finish_saved(result):
+    # バックグラウンドの保存が終わるのを待ち、保存時間と合計を確定する
+    for future in result.pop("saves", ()):
+        result["timings"]["save"] += future.result()
+    result["seconds"] = sum(result["timings"].values())
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def is_saved(result):
+    return all(future.done() for future in result.get("saves", ()))
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB、macOS は byte 単位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+OUTPUT_FORMATS = {
+    # 形式: (拡張子, 表示名)
+    "xlsx": (".xlsx", "Excel file"),
+    "csv": (".csv", "CSV file"),
+    "jsonl": (".jsonl", "JSONL file"),
+    "sqlite": (".sqlite", "SQLite database"),
+    "parquet": (".parquet", "Parquet file"),
+}
+EXPORT_FIELDS = [
+    "resource_type",
+    "module",
+    "name",
+    "index_key",
+    "path",
+    "value",
+    "description",
+]
+SQLITE_FILENAME = "resources.sqlite"
+
+
+def output_path_for(output_format, resource_type, output_folder):
+    if output_format == "sqlite":
+        # SQLite は全タイプを1つのデータベースにまとめる
+        return os.path.join(output_folder, SQLITE_FILENAME)
+    return os.path.join(output_folder, resource_type + OUTPUT_FORMATS[output_format][0])
+
+
+def iter_export_rows(resource_type, resource, type_descriptions, defaults=None):
+    # write_to_excel と同じ展開結果を (resource, path, value, description) の行にする
+    describe = description_lookup(type_descriptions)
+    module = resource.get("module", "")
+    name = resource["name"]
+    for instance in resource["instances"]:
+        index_key = instance.get("index_key")
+        for attribute in parse_attributes(instance["attributes"], defaults=defaults):
+            yield (
+                resource_type,
+                module,
+                name,
+                index_key,
+                attribute.path,
+                attribute.value,
+                describe[attribute.key],
+            )
+
+
+def text_value(value):
+    return "" if value is None else str(value)
+
+
+def write_csv_rows(output_path, rows):
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow([text_value(value) for value in row])
+
+
+def write_jsonl_rows(output_path, rows):
+    with open(output_path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False))
+            f.write("\n")
+
+
+def sqlite_value(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def write_sqlite_rows(output_path, rows):
+    # ワーカーが並列に書き込むので、ロックが解けるまで待つ
+    conn = sqlite3.connect(output_path, timeout=600)
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS attributes ({', '.join(EXPORT_FIELDS)})"
+        )
+        with conn:
+            conn.executemany(
+                f"INSERT INTO attributes VALUES ({', '.join('?' * len(EXPORT_FIELDS))})",
+                ([sqlite_value(value) for value in row] for row in rows),
+            )
+    finally:
+        conn.close()
+
+
+def index_sqlite_output(output_folder):
+    # インデックスは全タイプの書き込みが終わってから1回だけ作成する
+    output_path = os.path.join(output_folder, SQLITE_FILENAME)
+    if not os.path.isfile(output_path):
+        return
+    conn = sqlite3.connect(output_path, timeout=600)
+    try:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS attributes_type_path "
+            "ON attributes (resource_type, path)"
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Parquet は列ごとの配列が必要なので、この行数ごとに行グループとして書き込む
+PARQUET_ROW_GROUP_SIZE = 65536
+
+
+def write_parquet_rows(output_path, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(field, pa.string()) for field in EXPORT_FIELDS])
+
+    def row_group(columns):
+        return pa.Table.from_arrays(
+            [pa.array(column, type=pa.string()) for column in columns], schema=schema
+        )
+
+    with pq.ParquetWriter(output_path, schema) as writer:
+        columns = [[] for _ in EXPORT_FIELDS]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(None if value is None else str(value))
+            if len(columns[0]) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(row_group(columns))
+                columns = [[] for _ in EXPORT_FIELDS]
+        if columns[0]:
+            writer.write_table(row_group(columns))
+
+
+EXPORT_WRITERS = {
+    "csv": write_csv_rows,
+    "jsonl": write_jsonl_rows,
+    "sqlite": write_sqlite_rows,
+    "parquet": write_parquet_rows,
+}
+
+
+def write_resource_export(
+    output_format,
+    resource_type,
+    resources,
+    type_descriptions,
+    output_folder,
+    compact=None,
+):
+    # 行はリストに溜めず、1リソースずつ展開しながら書き込む
+    # 展開にかかった時間は flatten、残り (書き込み) は save として計る
+    start = time.perf_counter()
+    defaults = compact_defaults(type_descriptions, compact)
+    type_descriptions = description_lookup(type_descriptions)
+    counts = {"rows": 0, "flatten": 0.0}
+
+    def iter_rows():
+        for resource in resources:
+            flatten_start = time.perf_counter()
+            rows = list(
+                iter_export_rows(resource_type, resource, type_descriptions, defaults)
+            )
+            counts["flatten"] += time.perf_counter() - flatten_start
+            counts["rows"] += len(rows)
+            yield from rows
+
+    output_path = output_path_for(output_format, resource_type, output_folder)
+    EXPORT_WRITERS[output_format](output_path, iter_rows())
+    timings = {
+        "flatten": counts["flatten"],
+        "build": 0.0,
+        "style": 0.0,
+        "save": time.perf_counter() - start - counts["flatten"],
+    }
+    return {
+        "resource_type": resource_type,
+        "format": output_format,
+        "output_path": output_path,
+        "resources": len(resources),
+        "sheets": 0,
+        "rows": counts["rows"],
+        "cells": counts["rows"] * len(EXPORT_FIELDS),
+        "timings": timings,
+        "seconds": sum(timings.values()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def write_resource_output(
+    output_format,
+    resource_type,
+    resources,
+    type_descriptions,
+    output_folder,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    id_index=None,
+    layout=None,
+    saver=None,
+):
+    # id_index (リソースの ID へのハイパーリンク)、layout、saver は xlsx だけで使う
+    if output_format == "xlsx":
+        return write_resource_workbook(
+            resource_type,
+            resources,
+            type_descriptions,
+            output_folder,
+            workbook_options,
+            id_index,
+            layout,
+            saver,
+        )
+    return write_resource_export(
+        output_format,
+        resource_type,
+        resources,
+        type_descriptions,
+        output_folder,
+        workbook_options.compact,
+    )
+
+
+def result_message(result):
+    label = OUTPUT_FORMATS[result.get("format", "xlsx")][1]
+    if result.get("reused"):
+        return f"{label} reused from {result['previous_path']}"
+    if result.get("format") == "sqlite":
+        return f"{result['resource_type']} saved to {result['output_path']}"
+    more = len(result.get("output_paths", ())) - 1
+    if more > 0:
+        return f"{label} saved to {result['output_path']} (+{more} more)"
+    return f"{label} saved to {result['output_path']}"
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def resource_type_hash(resources, type_descriptions, options=None):
+    # リソースの属性・説明・出力の形式のバージョン・出力のオプションのどれかが変われば別のハッシュになる
+    digest = hashlib.sha256(f"format {OUTPUT_FORMAT_VERSION}".encode("utf-8"))
+    contents = (resources, type_descriptions)
+    if options:
+        contents += (options,)
+    for content in contents:
+        if isinstance(content, SpilledResources):
+            # リストをまとめて json.dumps したときと同じ値を1リソースずつ計算する
+            digest.update(b"[")
+            for number, resource in enumerate(content):
+                if number:
+                    digest.update(b",")
+                digest.update(resource_json(resource).encode("utf-8"))
+            digest.update(b"]")
+        else:
+            digest.update(resource_json(content).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_previous_manifest(run_folder, subfolder=""):
+    # 同じ親フォルダにある、より古いタイムスタンプフォルダのうち最新のマニフェストを探す
+    run_folder = os.path.abspath(run_folder)
+    parent_folder = os.path.dirname(run_folder)
+    current_name = os.path.basename(run_folder)
+    for name in sorted(os.listdir(parent_folder), reverse=True):
+        if name >= current_name:
+            continue
+        previous_folder = os.path.join(parent_folder, name, subfolder)
+        manifest_path = os.path.join(previous_folder, MANIFEST_FILENAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return previous_folder, json.load(f)
+    return None, {}
+
+
+def write_manifest(output_folder, type_hashes):
+    manifest = {
+        "version": __version__,
+        "format": OUTPUT_FORMAT_VERSION,
+        "types": type_hashes,
+    }
+    with open(
+        os.path.join(output_folder, MANIFEST_FILENAME), "w", encoding="utf-8"
+    ) as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class StateRun:
+    # 1つの tfstate の出力先・進捗・結果
+    def __init__(self, tfstate_file, run_folder, subfolder=""):
+        self.tfstate_file = tfstate_file
+        self.run_folder = run_folder
+        self.subfolder = subfolder
+        self.output_folder = (
+            os.path.join(run_folder, subfolder) if subfolder else run_folder
+        )
+        self.timings = {}
+        self.results = []
+        self.type_hashes = {}
+        self.resource_index = None  # --link-ids のときだけ作る
+        self.layouts = None  # リソースのブックとシートの配置 (WorkbookLayouts)
+        self.spill_folder = None  # --max-memory のときだけ作る
+        self.inventory = None  # --inventory のときだけ作る
+        self.total = 0
+        self.pending = 0
+        self.write_start = None
+
+    def progress(self):
+        done = f"{len(self.results)}/{self.total}"
+        return f"{self.subfolder} {done}" if self.subfolder else done
+
+
+def prepare_state_tasks(
+    state,
+    resources_by_type,
+    descriptions,
+    incremental=False,
+    output_format="xlsx",
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+):
+    state.total = len(resources_by_type)
+    state.write_start = time.perf_counter()
+    links_by_type = {}
+    if output_format == "xlsx" and (
+        state.resource_index is not None or state.inventory is not None
+    ):
+        # リンク先や一覧のブックとシートは、タイプごとの配置 (WorkbookLayouts) から求める
+        state.layouts = WorkbookLayouts(
+            resources_by_type, descriptions, workbook_options
+        )
+    if state.resource_index is not None and state.layouts is not None:
+        # リンク先のブックとシートを決めるため、参照されるタイプの配置を出力の前に求める
+        links_by_type = {
+            resource_type: state.resource_index.link_targets(
+                resource_type, state.layouts
+            )
+            for resource_type in resources_by_type
+        }
+    if incremental:
+        previous_folder, previous_manifest = load_previous_manifest(
+            state.run_folder, state.subfolder
+        )
+        previous_hashes = previous_manifest.get("types", {})
+        hash_options = {}
+        # 圧縮レベルはブックの内容を変えないので、ハッシュに含めない
+        content_options = workbook_options._replace(compresslevel=None)
+        if content_options != DEFAULT_WORKBOOK_OPTIONS:
+            hash_options["workbook_options"] = list(content_options)
+
+    tasks = []
+    for resource_type, resources in resources_by_type.items():
+        type_descriptions = descriptions.get(resource_type, {})
+        links = links_by_type.get(resource_type)
+        if incremental:
+            # 前回から内容が変わっていないタイプは前回のExcelを流用する
+            type_options = hash_options
+            if links is not None:
+                # 参照先の名前やブック・シートが変わった場合も作り直す
+                type_options = dict(
+                    hash_options, id_index=resource_type_hash(sorted(links.items()), {})
+                )
+            content_hash = resource_type_hash(
+                resources, type_descriptions, type_options
+            )
+            state.type_hashes[resource_type] = content_hash
+            if previous_hashes.get(resource_type) == content_hash:
+                previous_path = output_path_for(
+                    output_format, resource_type, previous_folder
+                )
+                if os.path.isfile(previous_path):
+                    output_path = output_path_for(
+                        output_format, resource_type, state.output_folder
+                    )
+                    link_or_copy(previous_path, output_path)
+                    if output_format == "xlsx":
+                        # 分割したブックも前回と同じ数だけ流用する
+                        previous_paths = workbook_parts(previous_folder, resource_type)
+                        for part, path in enumerate(previous_paths[1:], start=2):
+                            link_or_copy(
+                                path,
+                                workbook_path(state.output_folder, resource_type, part),
+                            )
+                    result = {
+                        "resource_type": resource_type,
+                        "format": output_format,
+                        "output_path": output_path,
+                        "previous_path": previous_path,
+                        "resources": len(resources),
+                        "reused": True,
+                    }
+                    state.results.append(result)
+                    print(f"[{state.progress()}] {result_message(result)}")
+                    continue
+        tasks.append(
+            (
+                output_format,
+                resource_type,
+                resources,
+                type_descriptions,
+                state.output_folder,
+                workbook_options,
+                links,
+                None if state.layouts is None else state.layouts.get(resource_type),
+            )
+        )
+    state.pending = len(tasks)
+    return tasks
+
+
+def remove_spill(state):
+    if state.spill_folder:
+        shutil.rmtree(state.spill_folder, ignore_errors=True)
+        state.spill_folder = None
+
+
+def finish_state(
+    state,
+    jobs,
+    incremental=False,
+    output_format="xlsx",
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+):
+    if incremental:
+        write_manifest(state.output_folder, state.type_hashes)
+    if output_format == "sqlite":
+        index_sqlite_output(state.output_folder)
+    inventory_path = None
+    if state.inventory is not None:
+        # 出力したタイプはワーカーが返した配置を使い、流用したタイプだけ配置を求める
+        for result in state.results:
+            if "layout" in result:
+                state.layouts.setdefault(result["resource_type"], result["layout"])
+        inventory_path = write_inventory(
+            state.output_folder, state.inventory, state.layouts, workbook_options
+        )
+        state.inventory = None
+    state.timings["write"] = time.perf_counter() - state.write_start
+    state.resource_index = None
+    state.layouts = None
+    remove_spill(state)
+    reused = sum(1 for result in state.results if result.get("reused"))
+    if output_format == "xlsx":
+        summary = f"{state.total} Excel files saved to {state.output_folder}"
+    else:
+        summary = (
+            f"{state.total} resource types ({output_format}) saved to "
+            f"{state.output_folder}"
+        )
+    print(
+        f"{summary} ({state.timings['write']:.1f}s, jobs={jobs}, reused={reused})"
+    )
+    if inventory_path:
+        print(f"Inventory saved to {inventory_path}")
+
+
+def write_states_to_excel(
+    states,
+    jobs=1,
+    incremental=False,
+    output_format="xlsx",
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+):
+    # states は (StateRun, resources_by_type, descriptions) を順に返す
+    # 全 tfstate のリソースタイプを1つのプロセスプールに流し込み、
+    # 未完了のタスクを jobs * 2 までに抑えて tfstate の読み込みと並行させる
+    finished = []
+
+    def complete(state, result):
+        state.results.append(result)
+        state.pending -= 1
+        print(f"[{state.progress()}] {result_message(result)}")
+        if state.pending == 0:
+            finish_state(state, jobs, incremental, output_format, workbook_options)
+
+    if jobs <= 1:
+        # 保存はバックグラウンドのスレッドで行い、次のタイプのブックの作成と重ねる
+        # 保存の終わったものから順に完了として報告する
+        saving = deque()
+
+        def report_saved(block=False):
+            while saving and (block or is_saved(saving[0][1])):
+                state, result = saving.popleft()
+                complete(state, finish_saved(result))
+
+        with WorkbookSaver() as saver:
+            for state, resources_by_type, descriptions in states:
+                tasks = prepare_state_tasks(
+                    state,
+                    resources_by_type,
+                    descriptions,
+                    incremental,
+                    output_format,
+                    workbook_options,
+                )
+                if not tasks:
+                    finish_state(
+                        state, jobs, incremental, output_format, workbook_options
+                    )
+                for task in tasks:
+                    saving.append((state, write_resource_output(*task, saver=saver)))
+                    report_saved()
+                finished.append(state)
+            report_saved(block=True)
+        return finished
+
+    futures = {}
+
+    def drain(return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            complete(futures.pop(future), future.result())
+
+    # リソースタイプごとに独立しているので、プロセスプールで並列に出力する
+    # ワーカーには担当タイプのリソースと説明だけを渡す
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for state, resources_by_type, descriptions in states:
+            tasks = prepare_state_tasks(
+                state,
+                resources_by_type,
+                descriptions,
+                incremental,
+                output_format,
+                workbook_options,
+            )
+            if not tasks:
+                finish_state(state, jobs, incremental, output_format, workbook_options)
+            for task in tasks:
+                while len(futures) >= jobs * 2:
+                    drain(FIRST_COMPLETED)
+                futures[executor.submit(write_resource_output, *task)] = state
+            finished.append(state)
+        while futures:
+            drain(FIRST_COMPLETED)
+    return finished
+
+
+def write_to_excel(
+    resources_by_type, descriptions, output_folder, jobs=1, incremental=False
+):
+    state = StateRun(None, output_folder)
+    write_states_to_excel(
+        [(state, resources_by_type, descriptions)], jobs, incremental
+    )
+    return state.results
+
+
+REPORT_FILENAME = "run_report.json"
+
+
+def build_run_report(tfstate_file, output_folder, jobs, timings, results):
+    built = [result for result in results if not result.get("reused")]
+    worker_peaks = [result["peak_rss_mb"] for result in built if result["peak_rss_mb"]]
+    return {
+        "version": __version__,
+        "tfstate_file": tfstate_name(tfstate_file),
+        "output_folder": os.path.abspath(output_folder),
+        "jobs": jobs,
+        "timings": timings,
+        "total_seconds": sum(timings.values()),
+        "workbooks": len(results),
+        "reused": len(results) - len(built),
+        "sheets": sum(result["sheets"] for result in built),
+        "rows": sum(result["rows"] for result in built),
+        "cells": sum(result["cells"] for result in built),
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_peak_rss_mb": max(worker_peaks) if worker_peaks else None,
+        # 時間のかかったタイプから順に並べる
+        "resource_types": sorted(
+            results, key=lambda result: result.get("seconds", 0.0), reverse=True
+        ),
+    }
+
+
+def write_run_report(report, output_folder):
+    report_path = os.path.join(output_folder, REPORT_FILENAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Run report saved to {report_path}")
+
+
+def print_profile(report, limit=10):
+    print(f"Profile of {report['tfstate_file']}")
+    print(
+        "Stages: "
+        + ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in report["timings"].items())
+    )
+    print(
+        f"Sheets: {report['sheets']}, rows: {report['rows']}, cells: {report['cells']}, "
+        f"peak RSS: {report['peak_rss_mb']} MB (workers: {report['worker_peak_rss_mb']} MB)"
+    )
+    print(f"{'resource_type':<50} {'flatten':>8} {'build':>8} {'style':>8} {'save':>8} {'rows':>8}")
+    for result in report["resource_types"][:limit]:
+        if result.get("reused"):
+            continue
+        timings = result["timings"]
+        print(
+            f"{result['resource_type']:<50} {timings['flatten']:8.3f} "
+            f"{timings['build']:8.3f} {timings['style']:8.3f} {timings['save']:8.3f} "
+            f"{result['rows']:8d}"
+        )
+
+
+def profile_resource_type(
+    resource_type,
+    resources,
+    type_descriptions,
+    output_folder,
+    output_format="xlsx",
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+):
+    # 最も時間のかかったタイプだけを cProfile 付きで作り直し、結果を保存する
+    profile_path = os.path.join(output_folder, f"profile_{resource_type}.pstats")
+    profiler = cProfile.Profile()
+    with tempfile.TemporaryDirectory() as work_folder:
+        profiler.runcall(
+            write_resource_output,
+            output_format,
+            resource_type,
+            resources,
+            type_descriptions,
+            work_folder,
+            workbook_options,
+        )
+    profiler.dump_stats(profile_path)
+    print(f"Profile of {resource_type} saved to {profile_path}")
+
+
+# --inventory: tfstate の読み込み中に1リソース1行の一覧を集め、各タイプのブックの後に
+# inventory.xlsx に出力する (リソースの属性は展開しない)
+INVENTORY_FILENAME = "inventory.xlsx"
+INVENTORY_HEADER = [
+    "resource_type",
+    "module",
+    "name",
+    "location",
+    "resource_group",
+    "instances",
+    "workbook",
+    "sheet",
+]
+
+
+def inventory_value(values):
+    # インスタンスごとの値を、重複を除いて現れた順に連結する
+    if len(values) == 1:
+        return str(values[0] or "")
+    return ", ".join(dict.fromkeys(str(value) for value in values if value))
+
+
+def inventory_row(resource):
+    # 読み込み中に全リソースで呼ぶので、属性の展開はせずにトップレベルの値だけを見る
+    instances = resource["instances"]
+    group_key = "resource_group_name"
+    if resource["type"] == "azurerm_resource_group":
+        group_key = "name"
+    locations = []
+    resource_groups = []
+    for instance in instances:
+        attributes = instance.get("attributes") or {}
+        locations.append(attributes.get("location"))
+        resource_groups.append(attributes.get(group_key))
+    return (
+        resource["type"],
+        resource.get("module", ""),
+        resource["name"],
+        inventory_value(locations),
+        inventory_value(resource_groups),
+        len(instances),
+    )
+
+
+def write_inventory(
+    output_folder, inventory, layouts, workbook_options=DEFAULT_WORKBOOK_OPTIONS
+):
+    # workbook と sheet の列は、リソースのシートへのハイパーリンクにする
+    # layouts: リソースタイプ -> リソースごとの (ブックの番号, シート名)。各タイプのブックと同じ
+    # 配置なので、分割したブックや --incremental で流用したブックのシートにもリンクできる
+    # 行数の上限を超えたら、見出しを繰り返した続きのシート "inventory (2)" に出力する
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    wb = WorkbookBuffer(workbook_options.max_sheet_rows)
+    ws = wb.create_sheet("inventory")
+    ws.append(INVENTORY_HEADER)
+    positions = defaultdict(int)
+    for row in inventory:
+        resource_type = row[0]
+        part, sheet_title = layouts[resource_type][positions[resource_type]]
+        positions[resource_type] += 1
+        workbook = workbook_filename(resource_type, part)
+        # XML で使えない制御文字は openpyxl が例外にするので取り除く
+        values = [
+            ILLEGAL_CHARACTERS_RE.sub("", value) if value.__class__ is str else value
+            for value in row
+        ]
+        values.append(LinkedValue(workbook, workbook, sheet_title))
+        values.append(LinkedValue(sheet_title, workbook, sheet_title))
+        ws.append(values)
+    output_path = os.path.join(output_folder, INVENTORY_FILENAME)
+    save_workbook(wb.render(), output_path, workbook_options.compresslevel)
+    return output_path
+
+
+def read_resources_by_type(
+    tfstate_file, resource_filter=None, resource_index=None, inventory=None
+):
+    with open_tfstate(tfstate_file) as f:
+        return group_resources_by_type(f, resource_filter, resource_index, inventory)
+
+
+def group_resources_by_type(
+    f, resource_filter=None, resource_index=None, inventory=None
+):
+    # resource_index や inventory を渡した場合は、同じ走査でリソースの ID の索引や一覧も作る
+    resources_by_type = defaultdict(list)
+    for res in iter_tfstate_resources(f, resource_filter):
+        if res["mode"] == "managed":
+            resources = resources_by_type[res["type"]]
+            if resource_index is not None:
+                resource_index.add(res, len(resources))
+            resources.append(res)
+            if inventory is not None:
+                inventory.append(inventory_row(res))
+    return resources_by_type
+
+
+# --max-memory: リソースをタイプごとにメモリに溜めず、一時的な SQLite に書き出してから
+# 1タイプずつ (ワーカーでは1リソースずつ) 読み戻して出力する
+SPILL_FILENAME = "spill.sqlite"
+SPILL_BATCH_SIZE = 1000
+
+
+def resource_json(resource):
+    # ハッシュを計算するための、キーの順序などを固定した JSON
+    return json.dumps(
+        resource,
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+
+
+class SpilledResources:
+    # 一時的な SQLite に書き出した1タイプ分のリソース (ワーカーにはパスとタイプだけを渡す)
+    def __init__(self, spill_path, resource_type, count):
+        self.spill_path = spill_path
+        self.resource_type = resource_type
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def iter_json(self):
+        conn = sqlite3.connect(self.spill_path)
+        try:
+            yield from (
+                text
+                for (text,) in conn.execute(
+                    "SELECT resource FROM resources WHERE type = ? ORDER BY id",
+                    (self.resource_type,),
+                )
+            )
+        finally:
+            conn.close()
+
+    def __iter__(self):
+        for text in self.iter_json():
+            yield json.loads(text)
+
+
+def spill_resources_by_type(
+    tfstate_file, spill_path, resource_filter=None, resource_index=None, inventory=None
+):
+    counts = defaultdict(int)
+    conn = sqlite3.connect(spill_path)
+    try:
+        # 一時ファイルなので、ジャーナルと同期書き込みは行わない
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(
+            "CREATE TABLE resources (id INTEGER PRIMARY KEY, type TEXT, resource TEXT)"
+        )
+        insert = "INSERT INTO resources (type, resource) VALUES (?, ?)"
+        batch = []
+        with open_tfstate(tfstate_file) as f:
+            for res in iter_tfstate_resources(f, resource_filter):
+                if res["mode"] != "managed":
+                    continue
+                if resource_index is not None:
+                    resource_index.add(res, counts[res["type"]])
+                if inventory is not None:
+                    inventory.append(inventory_row(res))
+                counts[res["type"]] += 1
+                # 属性の順序は出力の順序なので、キーは並べ替えない
+                batch.append((res["type"], json.dumps(res, ensure_ascii=False)))
+                if len(batch) >= SPILL_BATCH_SIZE:
+                    conn.executemany(insert, batch)
+                    batch = []
+        if batch:
+            conn.executemany(insert, batch)
+        conn.execute("CREATE INDEX resources_type ON resources (type, id)")
+        conn.commit()
+    finally:
+        conn.close()
+    return {
+        resource_type: SpilledResources(spill_path, resource_type, count)
+        for resource_type, count in counts.items()
+    }
+
+
+def limit_workbook_memory(workbook_options, max_memory_mb, jobs=1):
+    # 上限を同時に動くワーカーで分け合い、各ワーカーが作成中のブックをその中に収める
+    return workbook_options._replace(
+        max_workbook_bytes=max_memory_mb * 1024 * 1024 // max(jobs, 1)
+    )
+
+
+def expand_tfstate_paths(paths, missing=None):
+    # ファイル・フォルダ (配下の *.tfstate)・glob パターンを tfstate ファイルに展開する
+    # missing を渡した場合は、1つの tfstate にも一致しなかったパスやパターンを追加する
+    tfstate_files = []
+    for path in paths:
+        if path == STDIN_PATH:
+            if path not in tfstate_files:
+                tfstate_files.append(path)
+            continue
+        if os.path.isfile(path):
+            matches = [path]
+        elif os.path.isdir(path):
+            matches = sorted(
+                match
+                for suffix in TFSTATE_SUFFIXES
+                for match in glob.glob(
+                    os.path.join(path, "**", "*" + suffix), recursive=True
+                )
+            )
+        else:
+            matches = sorted(glob.glob(path, recursive=True))
+        matches = [match for match in matches if os.path.isfile(match)]
+        if not matches and missing is not None:
+            missing.append(path)
+        for match in matches:
+            if match not in tfstate_files:
+                tfstate_files.append(match)
+    return tfstate_files
+
+
+def state_subfolders(tfstate_files):
+    # tfstate が1つなら従来どおりタイムスタンプフォルダへ直接出力する
+    if len(tfstate_files) == 1:
+        return [""]
+    files = [path for path in tfstate_files if path != STDIN_PATH]
+    common_folder = os.path.commonpath(
+        [os.path.dirname(os.path.abspath(path)) for path in files] or ["."]
+    )
+    subfolders = []
+    for path in tfstate_files:
+        if path == STDIN_PATH:
+            relative = "stdin"
+        else:
+            relative = os.path.relpath(os.path.abspath(path), common_folder)
+        for suffix in TFSTATE_SUFFIXES:
+            if relative.endswith(suffix):
+                relative = relative[: -len(suffix)]
+                break
+        name = relative.replace(os.sep, "_").replace("/", "_")
+        subfolder, count = name, 2
+        while subfolder in subfolders:
+            subfolder = f"{name}_{count}"
+            count += 1
+        subfolders.append(subfolder)
+    return subfolders
+
+
+def iter_states(
+    state_runs,
+    description_cache,
+    resource_filter=None,
+    link_ids=False,
+    spill=False,
+    inventory=False,
+):
+    # tfstate は1つずつ読み込み、説明は全 tfstate で共有する
+    for state in state_runs:
+        start = time.perf_counter()
+        if link_ids:
+            state.resource_index = ResourceIndex()
+        if inventory:
+            state.inventory = []
+        if spill:
+            state.spill_folder = tempfile.mkdtemp(prefix="azurerm2excel-spill-")
+            resources_by_type = spill_resources_by_type(
+                state.tfstate_file,
+                os.path.join(state.spill_folder, SPILL_FILENAME),
+                resource_filter,
+                state.resource_index,
+                state.inventory,
+            )
+        else:
+            resources_by_type = read_resources_by_type(
+                state.tfstate_file,
+                resource_filter,
+                state.resource_index,
+                state.inventory,
+            )
+        state.timings["parse"] = time.perf_counter() - start
+
+        # tfstate に現れるリソースタイプの説明だけを読み込む
+        start = time.perf_counter()
+        descriptions = description_cache.load(resources_by_type)
+        state.timings["load_descriptions"] = time.perf_counter() - start
+
+        os.makedirs(state.output_folder, exist_ok=True)
+        yield state, resources_by_type, descriptions
+
+
+def process_tfstates(
+    tfstate_files,
+    description_folders,
+    output_folder,
+    jobs=1,
+    description_index=None,
+    incremental=False,
+    report_json=False,
+    profile=False,
+    output_format="xlsx",
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    resource_filter=None,
+    link_ids=False,
+    max_memory_mb=None,
+    inventory=False,
+):
+    start = time.perf_counter()
+    state_runs = [
+        StateRun(tfstate_file, output_folder, subfolder)
+        for tfstate_file, subfolder in zip(tfstate_files, state_subfolders(tfstate_files))
+    ]
+    description_cache = DescriptionCache(description_folders, description_index)
+    if max_memory_mb:
+        workbook_options = limit_workbook_memory(workbook_options, max_memory_mb, jobs)
+    try:
+        write_states_to_excel(
+            iter_states(
+                state_runs,
+                description_cache,
+                resource_filter,
+                link_ids,
+                spill=bool(max_memory_mb),
+                inventory=inventory,
+            ),
+            jobs,
+            incremental,
+            output_format,
+            workbook_options,
+        )
+    finally:
+        for state in state_runs:
+            remove_spill(state)
+    if len(state_runs) > 1:
+        outputs = sum(len(state.results) for state in state_runs)
+        print(
+            f"{len(state_runs)} tfstate files processed: {outputs} resource types "
+            f"saved to {output_folder} ({time.perf_counter() - start:.1f}s, jobs={jobs})"
+        )
+
+    if report_json or profile:
+        reports = [
+            build_run_report(
+                state.tfstate_file, state.output_folder, jobs, state.timings, state.results
+            )
+            for state in state_runs
+        ]
+        for report in reports:
+            if report_json:
+                write_run_report(report, report["output_folder"])
+            if profile:
+                print_profile(report)
+        slowest = max(
+            (
+                (result["seconds"], state.tfstate_file, result["resource_type"])
+                for state, report in zip(state_runs, reports)
+                for result in report["resource_types"]
+                if not result.get("reused")
+            ),
+            default=None,
+        )
+        if profile and slowest and slowest[1] == STDIN_PATH:
+            print("Skipping cProfile: the tfstate from stdin cannot be read again")
+        elif profile and slowest and max_memory_mb:
+            print("Skipping cProfile: re-reading the tfstate would exceed --max-memory")
+        elif profile and slowest:
+            # リソースは解放済みなので、対象の tfstate を読み直してプロファイルする
+            _, tfstate_file, resource_type = slowest
+            resources = read_resources_by_type(tfstate_file, resource_filter)[
+                resource_type
+            ]
+            profile_resource_type(
+                resource_type,
+                resources,
+                description_cache.descriptions.get(resource_type, {}),
+                output_folder,
+                output_format,
+                workbook_options,
+            )
+
+
+def process_tfstate(tfstate_file, description_folders, output_folder, jobs=1, **options):
+    process_tfstates([tfstate_file], description_folders, output_folder, jobs, **options)
+
+
+# --plan: openpyxl を使わずにブックの中身だけを組み立て (build_resource_workbooks と同じ)、
+# 出力の大きさを見積もる。xlsx のサイズは既定の圧縮レベルで実測した近似値 (バイト)
+PLAN_WORKBOOK_BYTES = 5000
+PLAN_SHEET_BYTES = 600
+PLAN_CELL_BYTES = 4
+PLAN_CHAR_BYTES = 0.11
+PLAN_COLUMNS = [
+    "resource_type",
+    "resources",
+    "workbooks",
+    "sheets",
+    "rows",
+    "cells",
+    "estimated_bytes",
+]
+
+
+def plan_resource_type(
+    resource_type,
+    resources,
+    type_descriptions,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    id_index=None,
+    layout=None,
+):
+    plan = dict.fromkeys(PLAN_COLUMNS, 0)
+    plan["resource_type"] = resource_type
+    plan["resources"] = len(resources)
+    warnings = plan["warnings"] = []
+    renamed = defaultdict(int)
+    chars = 0
+    for wb in build_resource_workbooks(
+        resource_type,
+        resources,
+        type_descriptions,
+        None,
+        workbook_options,
+        id_index,
+        layout,
+    ):
+        plan["workbooks"] += 1
+        plan["sheets"] += len(wb.sheets)
+        plan["rows"] += wb.rows
+        for sheet in wb.sheets:
+            plan["cells"] += sheet.cells
+            for row in sheet.rows:
+                for value in row:
+                    if value is not None:
+                        chars += len(str(value))
+            if sheet.parts > 1:
+                warnings.append(
+                    f"{sheet.title}: more than {workbook_options.max_sheet_rows} rows, "
+                    f"continued in {sheet.parts} sheets"
+                )
+            if sheet.split_rows:
+                warnings.append(
+                    f"{sheet.title}: {sheet.split_rows} rows have values longer than "
+                    f"{EXCEL_MAX_CELL_CHARS} characters (split into several rows)"
+                )
+            if len(sheet.title) > SHEET_TITLE_LENGTH:
+                warnings.append(
+                    f"{sheet.title}: sheet title longer than {SHEET_TITLE_LENGTH} "
+                    "characters"
+                )
+            if sheet.renamed_from:
+                renamed[sheet.renamed_from] += 1
+    for title, count in renamed.items():
+        warnings.append(
+            f"{title}: {count + 1} sheets with the same title (numbered {title}1, ...)"
+        )
+    plan["estimated_bytes"] = int(
+        plan["workbooks"] * PLAN_WORKBOOK_BYTES
+        + plan["sheets"] * PLAN_SHEET_BYTES
+        + plan["cells"] * PLAN_CELL_BYTES
+        + chars * PLAN_CHAR_BYTES
+    )
+    return plan
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def print_plan(tfstate_file, plans, seconds):
+    # 見積もりの大きいタイプから順に表示する
+    plans = sorted(plans, key=lambda plan: plan["estimated_bytes"], reverse=True)
+    total = dict.fromkeys(PLAN_COLUMNS, 0)
+    total["resource_type"] = "total"
+    for plan in plans:
+        for column in PLAN_COLUMNS[1:]:
+            total[column] += plan[column]
+    width = max([len(plan["resource_type"]) for plan in plans] + [13])
+    print(f"Plan of {tfstate_file} ({seconds:.1f}s)")
+    print(
+        f"  {'resource_type':<{width}} {'resources':>9} {'workbooks':>9} "
+        f"{'sheets':>7} {'rows':>9} {'cells':>10} {'estimated':>10} {'share':>6}"
+    )
+    for plan in plans + [total]:
+        share = plan["estimated_bytes"] / total["estimated_bytes"] * 100 if plans else 0
+        print(
+            f"  {plan['resource_type']:<{width}} {plan['resources']:>9} "
+            f"{plan['workbooks']:>9} {plan['sheets']:>7} {plan['rows']:>9} "
+            f"{plan['cells']:>10} {format_bytes(plan['estimated_bytes']):>10} "
+            f"{share:>5.1f}%"
+        )
+    warnings = [
+        (plan["resource_type"], warning)
+        for plan in plans
+        for warning in plan["warnings"]
+    ]
+    if warnings:
+        print(f"  {len(warnings)} warnings (Excel limits):")
+        for resource_type, warning in warnings:
+            print(f"    {resource_type} {warning}")
+
+
+def write_plan(plans_by_state, plan_path):
+    # .csv はタイプごとに1行、それ以外は JSON で保存する
+    if plan_path.endswith(".csv"):
+        with open(plan_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["tfstate_file"] + PLAN_COLUMNS + ["warnings"])
+            for tfstate_file, plans in plans_by_state:
+                for plan in plans:
+                    writer.writerow(
+                        [tfstate_file]
+                        + [plan[column] for column in PLAN_COLUMNS]
+                        + ["\n".join(plan["warnings"])]
+                    )
+    else:
+        with open(plan_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": __version__,
+                    "tfstates": [
+                        {"tfstate_file": tfstate_file, "resource_types": plans}
+                        for tfstate_file, plans in plans_by_state
+                    ],
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    print(f"Plan saved to {plan_path}")
+
+
+def plan_tfstates(
+    tfstate_files,
+    description_folders,
+    plan_path=None,
+    description_index=None,
+    workbook_options=DEFAULT_WORKBOOK_OPTIONS,
+    resource_filter=None,
+    link_ids=False,
+):
+    # 出力フォルダは作らず、読み込みと展開だけを行う
+    description_cache = DescriptionCache(description_folders, description_index)
+    plans_by_state = []
+    for tfstate_file in tfstate_files:
+        start = time.perf_counter()
+        resource_index = ResourceIndex() if link_ids else None
+        resources_by_type = read_resources_by_type(
+            tfstate_file, resource_filter, resource_index
+        )
+        descriptions = description_cache.load(resources_by_type)
+        layouts = WorkbookLayouts(resources_by_type, descriptions, workbook_options)
+        links_by_type = {
+            resource_type: resource_index.link_targets(resource_type, layouts)
+            for resource_type in resources_by_type
+            if resource_index is not None
+        }
+        plans = [
+            plan_resource_type(
+                resource_type,
+                resources,
+                descriptions.get(resource_type, {}),
+                workbook_options,
+                links_by_type.get(resource_type),
+                layouts.get(resource_type),
+            )
+            for resource_type, resources in resources_by_type.items()
+        ]
+        del resources_by_type
+        print_plan(tfstate_file, plans, time.perf_counter() - start)
+        plans_by_state.append((tfstate_file, plans))
+    if plan_path:
+        write_plan(plans_by_state, plan_path)
+    return plans_by_state
+
+
+DIFF_FORMATS = ("xlsx", "jsonl")
+
+
+def resource_address(resource, instance):
+    # terraform のリソースアドレス (module.x.azurerm_foo.bar["key"])
+    address = f"{resource['type']}.{resource['name']}"
+    if resource.get("module"):
+        address = f"{resource['module']}.{address}"
+    if "index_key" in instance:
+        address += f"[{json.dumps(instance['index_key'], ensure_ascii=False)}]"
+    return address
+
+
+def index_state_attributes(tfstate_file, resource_filter=None):
+    # リソースアドレス -> (リソースタイプ, {パス: (値, 正規化済みキー)})
+    index = {}
+    with open_tfstate(tfstate_file) as f:
+        for resource in iter_tfstate_resources(f, resource_filter):
+            if resource["mode"] != "managed":
+                continue
+            for instance in resource["instances"]:
+                index[resource_address(resource, instance)] = (
+                    resource["type"],
+                    {
+                        attribute.path: (attribute.value, attribute.key)
+                        for attribute in parse_attributes(instance["attributes"])
+                    },
+                )
+    return index
+
+
+def same_value(old_value, new_value):
+    # True と 1 のように型だけが変わった場合も変更として扱う
+    return old_value == new_value and type(old_value) is type(new_value)
+
+
+def diff_states(old_index, new_index):
+    # ハッシュ引きだけで比較するので、属性数に対して線形に終わる
+    # (change, address, resource_type, path, old_value, new_value, key)
+    changes = []
+    for address, (resource_type, new_attributes) in new_index.items():
+        old = old_index.get(address)
+        if old is None:
+            changes.append(("resource added", address, resource_type, "", None, None, ""))
+            continue
+        old_attributes = old[1]
+        for path, (new_value, key) in new_attributes.items():
+            old_attribute = old_attributes.get(path)
+            if old_attribute is None:
+                changes.append(("added", address, resource_type, path, None, new_value, key))
+            elif not same_value(old_attribute[0], new_value):
+                changes.append(
+                    ("changed", address, resource_type, path, old_attribute[0], new_value, key)
+                )
+        for path, (old_value, key) in old_attributes.items():
+            if path not in new_attributes:
+                changes.append(("removed", address, resource_type, path, old_value, None, key))
+    for address, (resource_type, _) in old_index.items():
+        if address not in new_index:
+            changes.append(("resource removed", address, resource_type, "", None, None, ""))
+    return changes
+
+
+def diff_summary(changes):
+    summary = defaultdict(lambda: defaultdict(int))
+    for change in changes:
+        summary[change[2]][change[0]] += 1
+    return summary
+
+
+DIFF_CHANGE_KINDS = ["resource added", "resource removed", "added", "removed", "changed"]
+
+
+def write_diff(changes, descriptions, output_folder, output_format="xlsx"):
+    lookups = {}
+
+    def description_of(change):
+        if not change[6]:
+            return ""
+        lookup = lookups.get(change[2])
+        if lookup is None:
+            lookup = lookups[change[2]] = DescriptionLookup(
+                descriptions.get(change[2], {})
+            )
+        return lookup[change[6]]
+
+    def display(change, value, side):
+        # 追加・削除された側は空欄にする
+        if change[0] in ("resource added", "resource removed"):
+            return ""
+        if (side == "old" and change[0] == "added") or (
+            side == "new" and change[0] == "removed"
+        ):
+            return ""
+        return str(value)
+
+    if output_format == "jsonl":
+        output_path = os.path.join(output_folder, "diff.jsonl")
+        with open(output_path, "w", encoding="utf-8") as f:
+            for change in changes:
+                record = {
+                    "change": change[0],
+                    "address": change[1],
+                    "resource_type": change[2],
+                    "path": change[3],
+                    "old": change[4],
+                    "new": change[5],
+                    "description": description_of(change),
+                }
+                f.write(json.dumps(record, ensure_ascii=False, default=str))
+                f.write("\n")
+        return output_path
+
+    wb = WorkbookBuffer()
+    ws_summary = wb.create_sheet(title="summary")
+    ws_summary.append(["resource_type"] + DIFF_CHANGE_KINDS)
+    for resource_type, counts in sorted(diff_summary(changes).items()):
+        ws_summary.append([resource_type] + [counts[kind] for kind in DIFF_CHANGE_KINDS])
+
+    ws_changes = wb.create_sheet(
+        title="changes", fixed_widths={"D": 60, "E": 60, "F": 60}
+    )
+    ws_changes.append(["change", "address", "path", "old", "new", "description"])
+    for change in changes:
+        ws_changes.append(
+            [
+                change[0],
+                change[1],
+                change[3],
+                display(change, change[4], "old"),
+                display(change, change[5], "new"),
+                description_of(change),
+            ]
+        )
+    output_path = os.path.join(output_folder, "diff.xlsx")
+    wb.save(output_path)
+    return output_path
+
+
+def process_diff(
+    old_tfstate_file,
+    new_tfstate_file,
+    description_folders,
+    output_folder,
+    description_index=None,
+    output_format="xlsx",
+    resource_filter=None,
+):
+    start = time.perf_counter()
+    old_index = index_state_attributes(old_tfstate_file, resource_filter)
+    new_index = index_state_attributes(new_tfstate_file, resource_filter)
+    changes = diff_states(old_index, new_index)
+    resource_types = {change[2] for change in changes}
+    del old_index, new_index
+
+    # 変更のあったリソースタイプの説明だけを読み込む
+    descriptions = DescriptionCache(description_folders, description_index).load(
+        resource_types
+    )
+    output_path = write_diff(changes, descriptions, output_folder, output_format)
+    counts = defaultdict(int)
+    for change in changes:
+        counts[change[0]] += 1
+    print(
+        ", ".join(f"{kind}: {counts[kind]}" for kind in DIFF_CHANGE_KINDS)
+    )
+    print(f"Diff saved to {output_path} ({time.perf_counter() - start:.1f}s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="azure環境を構築したtfstateファイルからパラメタシート（Excel）を作成します"
+    )
+    parser.add_argument(
+        "tfstate_file",
+        help="tfstate file (.gz/.zst supported), folder of *.tfstate files, "
+        "glob pattern or - for stdin",
+    )
+    parser.add_argument(
+        "description_folders", nargs="+", help="description folders (*.json)"
+    )
+    parser.add_argument(
+        "-s",
+        "--tfstate",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="additional tfstate file, folder or glob pattern (repeatable)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes for workbook generation (0: CPU count)",
+    )
+    parser.add_argument(
+        "--description-index",
+        metavar="PATH",
+        help="SQLite index compiled from the description folders; "
+        "rebuilt automatically when the folders change",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse workbooks of unchanged resource types from the previous output "
+        f"folder (tracked in {MANIFEST_FILENAME})",
+    )
+    parser.add_argument(
+        "--report-json",
+        action="store_true",
+        help=f"write stage timings, counts and peak memory to {REPORT_FILENAME} "
+        "in the output folder",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print stage timings per resource type and save a cProfile dump of "
+        "the slowest type",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=list(OUTPUT_FORMATS),
+        default="xlsx",
+        help="output format; csv/jsonl/parquet write one file per resource type, "
+        f"sqlite writes a single {SQLITE_FILENAME} (default: xlsx)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        metavar="MB",
+        help="memory ceiling: spill resources to a temporary SQLite file while "
+        "reading and keep each workbook under MB / jobs (splits into "
+        "<resource_type>_2.xlsx, ... between resources)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        help="ZIP compression level of the xlsx files; 0 stores without "
+        "compression (fastest, larger files), 1 is fast, 9 is smallest "
+        "(default: zlib default)",
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="",
+        metavar="PATH",
+        help="dry run: flatten the resources without openpyxl and print the "
+        "workbooks, sheets, rows, cells and estimated size per resource type, "
+        "with warnings for Excel limits; PATH also saves it as JSON (or .csv)",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="leave out attributes whose value is null or empty",
+    )
+    parser.add_argument(
+        "--compact-defaults",
+        action="store_true",
+        help="--compact, and also leave out values equal to the default written in "
+        "the description (\"Defaults to `false`.\")",
+    )
+    parser.add_argument(
+        "--inventory",
+        action="store_true",
+        help="also write inventory.xlsx listing every managed resource with its "
+        "module, location, resource group, instance count and a link to its sheet "
+        "(xlsx only)",
+    )
+    parser.add_argument(
+        "--rule-analysis",
+        action="store_true",
+        help="add a sheet listing shadowed, duplicate and overlapping rules of "
+        "network security groups and firewall policies (xlsx only)",
+    )
+    parser.add_argument(
+        "--link-ids",
+        action="store_true",
+        help="turn attribute values that are IDs of other resources in the tfstate "
+        "into hyperlinks to their sheets and add a Reference column (xlsx only)",
+    )
+    parser.add_argument(
+        "--max-sheet-rows",
+        type=int,
+        default=EXCEL_MAX_ROWS,
+        metavar="N",
+        help="rows per sheet including the header; further rows continue on "
+        f"'<sheet> (2)', ... (default and maximum: {EXCEL_MAX_ROWS})",
+    )
+    parser.add_argument(
+        "--max-workbook-rows",
+        type=int,
+        default=0,
+        metavar="N",
+        help="start <resource_type>_2.xlsx, ... once a workbook reaches N rows; "
+        "split between resources (default: 0, no limit)",
+    )
+    filters = parser.add_argument_group(
+        "resource filters",
+        "glob patterns, or regular expressions prefixed with 're:', matched against "
+        "the whole value; each option is repeatable",
+    )
+    for field, label in (
+        ("type", "resource type"),
+        ("module", "module address (module.network.module.nsg)"),
+        ("name", "resource name"),
+    ):
+        filters.add_argument(
+            f"--include-{field}",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help=f"only output resources whose {label} matches",
+        )
+        filters.add_argument(
+            f"--exclude-{field}",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help=f"skip resources whose {label} matches",
+        )
+    parser.add_argument(
+        "--diff",
+        metavar="OLD_TFSTATE",
+        help="compare OLD_TFSTATE with the tfstate and write only the added, "
+        "removed and changed attributes (diff.xlsx, or diff.jsonl with --format jsonl)",
+    )
+    args = parser.parse_args(argv)
+    if args.link_ids and (args.format != "xlsx" or args.diff):
+        parser.error("--link-ids works only for xlsx parameter sheets (not --diff)")
+    if args.plan is not None and (args.format != "xlsx" or args.diff):
+        parser.error("--plan sizes xlsx parameter sheets (not --format or --diff)")
+    if args.inventory and (args.format != "xlsx" or args.diff):
+        parser.error("--inventory works only for xlsx parameter sheets (not --diff)")
+    if args.rule_analysis and (args.format != "xlsx" or args.diff):
+        parser.error(
+            "--rule-analysis works only for xlsx parameter sheets (not --diff)"
+        )
+    if args.diff and args.format not in DIFF_FORMATS:
+        parser.error(f"--diff supports --format {' or '.join(DIFF_FORMATS)}")
+    if args.format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            parser.error("--format parquet requires pyarrow (pip install pyarrow)")
+    if args.incremental and args.format == "sqlite":
+        parser.error("--incremental is not supported with --format sqlite")
+    if not 2 <= args.max_sheet_rows <= EXCEL_MAX_ROWS:
+        parser.error(f"--max-sheet-rows must be between 2 and {EXCEL_MAX_ROWS}")
+    if args.max_workbook_rows < 0:
+        parser.error("--max-workbook-rows must be 0 or a positive number")
+    compact = None
+    if args.compact_defaults:
+        compact = "defaults"
+    elif args.compact:
+        compact = "empty"
+    args.workbook_options = WorkbookOptions(
+        args.max_sheet_rows,
+        args.max_workbook_rows or None,
+        compresslevel=args.compress_level,
+        rule_analysis=args.rule_analysis,
+        compact=compact,
+    )
+    include, exclude = {}, {}
+    for field in ResourceFilter.FIELDS:
+        include[field] = getattr(args, f"include_{field}")
+        exclude[field] = getattr(args, f"exclude_{field}")
+    args.resource_filter = None
+    if any(include.values()) or any(exclude.values()):
+        try:
+            args.resource_filter = ResourceFilter(include, exclude)
+        except re.error as e:
+            parser.error(f"invalid resource filter: {e}")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or a positive number")
+    if args.max_memory is not None and args.max_memory <= 0:
+        parser.error("--max-memory must be a positive number of megabytes")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    description_folders = args.description_folders
+    output_folder = "output"  # 固定の出力フォルダ
+
+    missing = []
+    tfstate_files = expand_tfstate_paths([args.tfstate_file] + args.tfstate, missing)
+    if missing:
+        for path in missing:
+            if os.path.isdir(path) or glob.escape(path) != path:
+                print(f"Error: No tfstate file matches {path}。")
+            else:
+                print(f"Error: The file {path} does not exist。")
+        sys.exit(1)
+    if args.diff:
+        if args.diff != STDIN_PATH and not os.path.isfile(args.diff):
+            print(f"Error: The file {args.diff} does not exist。")
+            sys.exit(1)
+        if len(tfstate_files) != 1:
+            print("Error: --diff compares exactly one tfstate file。")
+            sys.exit(1)
+        if args.diff == STDIN_PATH and tfstate_files[0] == STDIN_PATH:
+            print("Error: stdin can be read only once。")
+            sys.exit(1)
+    if importlib.util.find_spec("zstandard") is None:
+        # 拡張子のない zstd (標準入力など) も、読み込みの途中ではなくここでエラーにする
+        for path in tfstate_files + [args.diff]:
+            if path and is_zstd_tfstate(path):
+                name = "stdin" if path == STDIN_PATH else path
+                print(f"Error: {name} requires zstandard (pip install zstandard)。")
+                sys.exit(1)
+
+    for description_folder in description_folders:  # 各フォルダをチェック
+        if not os.path.isdir(description_folder):
+            print(f"Error: The directory {description_folder} does not exist。")
+            sys.exit(1)
+
+    if args.plan is not None:
+        plan_tfstates(
+            tfstate_files,
+            description_folders,
+            args.plan,
+            description_index=args.description_index,
+            workbook_options=args.workbook_options,
+            resource_filter=args.resource_filter,
+            link_ids=args.link_ids,
+        )
+        sys.exit(0)
+
+    # フォルダが存在しない場合は作成する
+    if not os.path.isdir(output_folder):
+        print(f"Creating output folder: {output_folder}")
+        os.makedirs(output_folder)
+
+    # YYYYMMDDss フォルダを作成
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    output_folder = os.path.join(output_folder, timestamp)
+    os.makedirs(output_folder)
+
+    if args.diff:
+        process_diff(
+            args.diff,
+            tfstate_files[0],
+            description_folders,
+            output_folder,
+            description_index=args.description_index,
+            output_format=args.format,
+            resource_filter=args.resource_filter,
+        )
+        sys.exit(0)
+
+    process_tfstates(
+        tfstate_files,
+        description_folders,
+        output_folder,
+        args.jobs,
+        description_index=args.description_index,
+        incremental=args.incremental,
+        report_json=args.report_json,
+        profile=args.profile,
+        output_format=args.format,
+        workbook_options=args.workbook_options,
+        resource_filter=args.resource_filter,
+        link_ids=args.link_ids,
+        max_memory_mb=args.max_memory,
+        inventory=args.inventory,
     )
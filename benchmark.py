@@ -0,0 +1,506 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import azurerm2excel
+
+STAGES = ["parse", "load_descriptions", "flatten", "build", "style", "save"]
+
+# 短すぎるステージは誤差が大きいので、回帰判定の対象外にする (秒)
+MIN_COMPARE_SECONDS = 0.05
+
+
+# ---------------------------------------------------------------------------
+# synthetic tfstate generator
+# ---------------------------------------------------------------------------
+
+
+def resource_id(resource_type, name):
+    return (
+        "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/rg-bench"
+        f"/providers/Microsoft.Bench/{resource_type}/{name}"
+    )
+
+
+def generic_resource(resource_type, index, rng):
+    name = f"{resource_type.split('_', 1)[-1]}{index}"
+    attributes = {
+        "id": resource_id(resource_type, name),
+        "name": name,
+        "location": rng.choice(["japaneast", "japanwest"]),
+        "resource_group_name": "rg-bench",
+        "tags": {"env": "bench", "owner": f"team{index % 7}"},
+        "enabled": bool(index % 2),
+        "sku_name": rng.choice(["Basic", "Standard", "Premium"]),
+        "address_space": [f"10.{index % 256}.{n}.0/24" for n in range(3)],
+        "ip_configuration": [
+            {
+                "name": f"ipconfig{n}",
+                "private_ip_address": f"10.0.{n}.{index % 256}",
+                "private_ip_address_allocation": "Static",
+                "subnet_id": resource_id("subnets", f"snet{n}"),
+            }
+            for n in range(2)
+        ],
+        "timeouts": None,
+    }
+    return {
+        "mode": "managed",
+        "type": resource_type,
+        "name": name,
+        "provider": 'provider["registry.terraform.io/hashicorp/azurerm"]',
+        "instances": [{"schema_version": 0, "attributes": attributes}],
+    }
+
+
+def network_security_group(index, rules, rng):
+    name = f"nsg{index}"
+    security_rules = []
+    for n in range(rules):
+        security_rules.append(
+            {
+                "access": rng.choice(["Allow", "Deny"]),
+                "description": f"rule {n}",
+                "destination_address_prefix": f"10.{n % 256}.0.0/16",
+                "destination_address_prefixes": [],
+                "destination_application_security_group_ids": [],
+                "destination_port_range": "" if n % 3 == 0 else str(1024 + n),
+                "destination_port_ranges": ["80", "443"] if n % 3 == 0 else [],
+                "direction": rng.choice(["Inbound", "Outbound"]),
+                "name": f"rule{n}",
+                "priority": 100 + n,
+                "protocol": rng.choice(["Tcp", "Udp", "*"]),
+                "source_address_prefix": "*",
+                "source_address_prefixes": [],
+                "source_application_security_group_ids": [],
+                "source_port_range": "*",
+                "source_port_ranges": [],
+            }
+        )
+    return {
+        "mode": "managed",
+        "type": "azurerm_network_security_group",
+        "name": name,
+        "provider": 'provider["registry.terraform.io/hashicorp/azurerm"]',
+        "instances": [
+            {
+                "schema_version": 0,
+                "attributes": {
+                    "id": resource_id("networkSecurityGroups", name),
+                    "location": "japaneast",
+                    "name": name,
+                    "resource_group_name": "rg-bench",
+                    "security_rule": security_rules,
+                    "tags": {},
+                    "timeouts": None,
+                },
+            }
+        ],
+    }
+
+
+def rule_collection_group(index, collections, collection_rules, addresses):
+    def addresses_for(collection, rule):
+        return [
+            f"10.{collection % 256}.{(rule + n // 256) % 256}.{n % 256}/32"
+            for n in range(addresses)
+        ]
+
+    def application_rule(collection, rule):
+        return {
+            "description": "",
+            "destination_addresses": addresses_for(collection, rule),
+            "destination_fqdn_tags": [],
+            "destination_fqdns": [f"app{rule}.example.com"],
+            "destination_urls": [],
+            "http_headers": [],
+            "name": f"aprule{rule}",
+            "protocols": [{"port": 443, "type": "Https"}, {"port": 80, "type": "Http"}],
+            "source_addresses": ["10.0.0.0/8"],
+            "source_ip_groups": [],
+            "terminate_tls": False,
+            "web_categories": [],
+        }
+
+    def network_rule(collection, rule):
+        return {
+            "description": "",
+            "destination_addresses": addresses_for(collection, rule),
+            "destination_fqdns": [],
+            "destination_ip_groups": [],
+            "destination_ports": [str(1000 + rule), "443"],
+            "name": f"netrule{rule}",
+            "protocols": ["TCP", "UDP"],
+            "source_addresses": ["10.0.0.0/8"],
+            "source_ip_groups": [],
+        }
+
+    def nat_rule(collection, rule):
+        return {
+            "description": "",
+            "destination_address": "203.0.113.10",
+            "destination_ports": [str(8000 + rule)],
+            "name": f"natrule{rule}",
+            "protocols": ["TCP"],
+            "source_addresses": ["*"],
+            "source_ip_groups": [],
+            "translated_address": f"10.0.0.{rule % 256}",
+            "translated_fqdn": "",
+            "translated_port": "443",
+        }
+
+    def collection_list(prefix, action, rule_factory, priority_base):
+        return [
+            {
+                "action": action,
+                "name": f"{prefix}{collection}",
+                "priority": priority_base + collection,
+                "rule": [
+                    rule_factory(collection, rule) for rule in range(collection_rules)
+                ],
+            }
+            for collection in range(collections)
+        ]
+
+    name = f"rcg{index}"
+    return {
+        "mode": "managed",
+        "type": "azurerm_firewall_policy_rule_collection_group",
+        "name": name,
+        "provider": 'provider["registry.terraform.io/hashicorp/azurerm"]',
+        "instances": [
+            {
+                "schema_version": 0,
+                "attributes": {
+                    "application_rule_collection": collection_list(
+                        "apcol", "Allow", application_rule, 1000
+                    ),
+                    "firewall_policy_id": resource_id("firewallPolicies", "fwp-bench"),
+                    "id": resource_id("ruleCollectionGroups", name),
+                    "name": name,
+                    "nat_rule_collection": collection_list(
+                        "natcol", "Dnat", nat_rule, 100
+                    ),
+                    "network_rule_collection": collection_list(
+                        "netcol", "Allow", network_rule, 2000
+                    ),
+                    "priority": 100 + index,
+                    "timeouts": None,
+                },
+            }
+        ],
+    }
+
+
+def generate_resources(
+    types=20,
+    instances=5,
+    nsgs=2,
+    rules=100,
+    policies=1,
+    collections=5,
+    collection_rules=20,
+    addresses=50,
+    seed=0,
+):
+    rng = random.Random(seed)
+    for type_index in range(types):
+        resource_type = f"azurerm_bench_type{type_index}"
+        for index in range(instances):
+            yield generic_resource(resource_type, index, rng)
+    for index in range(nsgs):
+        yield network_security_group(index, rules, rng)
+    for index in range(policies):
+        yield rule_collection_group(index, collections, collection_rules, addresses)
+
+
+def generate_tfstate(path, **scale):
+    # resources を1件ずつ書き出すので、大きな tfstate でもメモリを使わない
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"version": 4, "terraform_version": "1.9.0", "serial": 1, ')
+        f.write('"lineage": "benchmark", "outputs": {}, "resources": [\n')
+        for count, resource in enumerate(generate_resources(**scale)):
+            if count:
+                f.write(",\n")
+            json.dump(resource, f, ensure_ascii=False)
+        f.write('\n], "check_results": null}\n')
+
+
+def generate_descriptions(folder, types=20, extra_types=200):
+    # tfstate に現れないタイプも含めて、説明フォルダの読み込みコストを再現する
+    os.makedirs(folder, exist_ok=True)
+    resource_types = [f"azurerm_bench_type{n}" for n in range(types + extra_types)]
+    resource_types += [
+        "azurerm_network_security_group",
+        "azurerm_firewall_policy_rule_collection_group",
+    ]
+    keys = [
+        "id",
+        "name",
+        "location",
+        "resource_group_name",
+        "tags",
+        "enabled",
+        "sku_name",
+        "address_space",
+        "ip_configuration",
+        "ip_configuration.name",
+        "ip_configuration.private_ip_address",
+        "ip_configuration.subnet_id",
+        "security_rule",
+        "security_rule.priority",
+        "security_rule.direction",
+        "application_rule_collection.rule.name",
+        "network_rule_collection.rule.destination_addresses",
+    ]
+    for resource_type in resource_types:
+        with open(
+            os.path.join(folder, f"{resource_type}.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(
+                {key: f"({resource_type}) description of {key}" for key in keys}, f
+            )
+
+
+# ---------------------------------------------------------------------------
+# benchmark harness
+# ---------------------------------------------------------------------------
+
+
+def run_benchmark(tfstate_file, description_folders, output_folder, trace_memory=False):
+    timings = dict.fromkeys(STAGES, 0.0)
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    resources_by_type = azurerm2excel.read_resources_by_type(tfstate_file)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    descriptions = azurerm2excel.load_descriptions(
+        description_folders, set(resources_by_type)
+    )
+    timings["load_descriptions"] = time.perf_counter() - start
+
+    sheets = rows = 0
+    for resource_type, resources in resources_by_type.items():
+        type_descriptions = descriptions.get(resource_type, {})
+
+        start = time.perf_counter()
+        attribute_lists = [
+            azurerm2excel.flatten_resource(resource) for resource in resources
+        ]
+        timings["flatten"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        wb = azurerm2excel.WorkbookBuffer()
+        for resource, attribute_list in zip(resources, attribute_lists):
+            azurerm2excel.add_resource_sheets(
+                wb, resource_type, resource, attribute_list, type_descriptions
+            )
+        timings["build"] += time.perf_counter() - start
+        sheets += len(wb.sheets)
+        rows += sum(len(sheet.rows) for sheet in wb.sheets)
+        del attribute_lists
+
+        start = time.perf_counter()
+        workbook = wb.render()
+        timings["style"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        workbook.save(os.path.join(output_folder, f"{resource_type}.xlsx"))
+        timings["save"] += time.perf_counter() - start
+
+    result = {
+        "timings": timings,
+        "total": sum(timings.values()),
+        "resource_types": len(resources_by_type),
+        "sheets": sheets,
+        "rows": rows,
+        "peak_rss_mb": azurerm2excel.peak_rss_mb(),
+    }
+    if trace_memory:
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return result
+
+
+def best_of(results):
+    # 繰り返し実行した場合は、ステージごとの最小値を採用する
+    best = dict(results[0])
+    best["timings"] = {
+        stage: min(result["timings"][stage] for result in results) for stage in STAGES
+    }
+    best["total"] = min(result["total"] for result in results)
+    return best
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    regressions = []
+    for stage in STAGES + ["total"]:
+        if stage == "total":
+            current, previous = result["total"], baseline["total"]
+        else:
+            current = result["timings"][stage]
+            previous = baseline["timings"].get(stage, 0.0)
+        if max(current, previous) < MIN_COMPARE_SECONDS:
+            continue
+        if current > previous * (1 + tolerance):
+            regressions.append(f"{stage}: {previous:.3f}s -> {current:.3f}s")
+    for key in ("peak_rss_mb", "peak_traced_mb"):
+        current, previous = result.get(key), baseline.get(key)
+        if current and previous and current > previous * (1 + tolerance):
+            regressions.append(f"{key}: {previous:.1f}MB -> {current:.1f}MB")
+    return regressions
+
+
+def print_result(result, baseline=None):
+    print(
+        f"resource types: {result['resource_types']}, "
+        f"sheets: {result['sheets']}, rows: {result['rows']}"
+    )
+    for stage in STAGES + ["total"]:
+        seconds = result["total"] if stage == "total" else result["timings"][stage]
+        line = f"  {stage:<18} {seconds:9.3f}s"
+        if baseline:
+            previous = (
+                baseline["total"] if stage == "total" else baseline["timings"][stage]
+            )
+            if previous:
+                line += f"  (baseline {previous:.3f}s, {seconds / previous:5.2f}x)"
+        print(line)
+    for key in ("peak_rss_mb", "peak_traced_mb"):
+        if result.get(key) is not None:
+            print(f"  {key:<18} {result[key]:9.1f}MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="azurerm2excel のステージごとの処理時間とメモリを計測します"
+    )
+    scale = parser.add_argument_group("synthetic tfstate scale")
+    scale.add_argument("--types", type=int, default=20, help="generic resource types")
+    scale.add_argument("--instances", type=int, default=5, help="resources per type")
+    scale.add_argument("--nsgs", type=int, default=2, help="network security groups")
+    scale.add_argument("--rules", type=int, default=100, help="security rules per NSG")
+    scale.add_argument(
+        "--policies", type=int, default=1, help="firewall policy rule collection groups"
+    )
+    scale.add_argument(
+        "--collections", type=int, default=5, help="rule collections per kind"
+    )
+    scale.add_argument(
+        "--collection-rules", type=int, default=20, help="rules per collection"
+    )
+    scale.add_argument(
+        "--addresses", type=int, default=50, help="destination_addresses per rule"
+    )
+    scale.add_argument("--seed", type=int, default=0)
+
+    parser.add_argument(
+        "--tfstate",
+        help="benchmark an existing tfstate instead of generating one "
+        "(requires --descriptions)",
+    )
+    parser.add_argument(
+        "--descriptions", nargs="+", default=[], help="description folders"
+    )
+    parser.add_argument(
+        "--generate-only",
+        metavar="PATH",
+        help="only write the synthetic tfstate to PATH and exit",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs (best is kept)")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also record the peak Python heap with tracemalloc (slower)",
+    )
+    parser.add_argument("--save-baseline", metavar="PATH", help="store the result")
+    parser.add_argument(
+        "--baseline", metavar="PATH", help="compare with a stored result"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown against the baseline (0.2 = 20%%)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = {
+        "types": args.types,
+        "instances": args.instances,
+        "nsgs": args.nsgs,
+        "rules": args.rules,
+        "policies": args.policies,
+        "collections": args.collections,
+        "collection_rules": args.collection_rules,
+        "addresses": args.addresses,
+        "seed": args.seed,
+    }
+    if args.generate_only:
+        generate_tfstate(args.generate_only, **scale)
+        print(f"Synthetic tfstate saved to {args.generate_only}")
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="azurerm2excel-bench-") as work_folder:
+        tfstate_file = args.tfstate
+        description_folders = args.descriptions
+        if tfstate_file is None:
+            tfstate_file = os.path.join(work_folder, "bench.tfstate")
+            generate_tfstate(tfstate_file, **scale)
+            if not description_folders:
+                description_folders = [os.path.join(work_folder, "descriptions")]
+                generate_descriptions(description_folders[0], args.types)
+        elif not description_folders:
+            print("Error: --descriptions is required with --tfstate")
+            return 1
+
+        results = []
+        for run in range(args.repeat):
+            output_folder = os.path.join(work_folder, f"output{run}")
+            os.makedirs(output_folder)
+            results.append(
+                run_benchmark(
+                    tfstate_file, description_folders, output_folder, args.trace_memory
+                )
+            )
+    result = best_of(results)
+    result["scale"] = scale if args.tfstate is None else {"tfstate": args.tfstate}
+    result["version"] = azurerm2excel.__version__
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if baseline:
+        if baseline.get("scale") != result["scale"]:
+            print("Warning: the baseline was recorded with a different scale")
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("Performance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
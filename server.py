@@ -0,0 +1,436 @@
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import azurerm2excel
+
+# 常駐してパラメタシートを作成する HTTP サーバー
+#   POST /workbook  リクエストボディの tfstate (gzip / zstd 可) からパラメタシートを返す
+#   GET  /health    キャッシュの状態を返す
+# 説明は読み込んだタイプをプロセス内に保持し、ワーカープロセスは openpyxl を読み込んだまま使い回す
+
+CONTENT_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv; charset=utf-8",
+    ".jsonl": "application/x-ndjson; charset=utf-8",
+    ".sqlite": "application/vnd.sqlite3",
+    ".parquet": "application/vnd.apache.parquet",
+    ".zip": "application/zip",
+}
+
+# zip に入れるときに圧縮し直さない (既に圧縮済みの) 形式
+STORED_EXTENSIONS = (".xlsx", ".parquet")
+
+# 応答の zip はこのサイズまでメモリ上に作り、超えたら一時ファイルに書く
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RequestBody(io.RawIOBase):
+    # Content-Length までしか読まないリクエストボディ (keep-alive の接続で読み過ぎない)
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.rfile.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def description_types(description_folders):
+    return {
+        filename.split(".")[0]
+        for description_folder in description_folders
+        for filename in os.listdir(description_folder)
+        if filename.endswith(".json")
+    }
+
+
+def request_filter(query):
+    include, exclude = {}, {}
+    for field in azurerm2excel.ResourceFilter.FIELDS:
+        include[field] = query.get(f"include_{field}", [])
+        exclude[field] = query.get(f"exclude_{field}", [])
+    if not any(include.values()) and not any(exclude.values()):
+        return None
+    try:
+        return azurerm2excel.ResourceFilter(include, exclude)
+    except re.error as e:
+        raise RequestError(400, f"invalid resource filter: {e}") from None
+
+
+def zip_outputs(output_folder):
+    archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with zipfile.ZipFile(archive, "w") as zf:
+        for filename in sorted(os.listdir(output_folder)):
+            compression = (
+                zipfile.ZIP_STORED
+                if filename.endswith(STORED_EXTENSIONS)
+                else zipfile.ZIP_DEFLATED
+            )
+            zf.write(
+                os.path.join(output_folder, filename),
+                filename,
+                compress_type=compression,
+            )
+    archive.seek(0)
+    return archive
+
+
+class ParameterSheetServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        description_folders,
+        jobs=1,
+        max_requests=1,
+        description_index=None,
+        allow_path=False,
+        workbook_options=azurerm2excel.DEFAULT_WORKBOOK_OPTIONS,
+    ):
+        super().__init__(address, ParameterSheetHandler)
+        self.description_cache = azurerm2excel.DescriptionCache(
+            description_folders, description_index
+        )
+        self.description_lock = threading.Lock()
+        # 同時に処理するリクエスト数とワーカープロセス数の上限
+        self.slots = threading.BoundedSemaphore(max_requests)
+        # ワーカーは起動時に openpyxl を読み込み、名前付きスタイルを作っておく (render で使い回す)
+        self.executor = ProcessPoolExecutor(
+            max_workers=jobs, initializer=azurerm2excel.named_styles
+        )
+        self.jobs = jobs
+        self.max_requests = max_requests
+        self.allow_path = allow_path
+        self.workbook_options = workbook_options
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+
+    def preload(self):
+        types = description_types(self.description_cache.description_folders)
+        with self.description_lock:
+            self.description_cache.load(types)
+        # ワーカープロセスを起動しておき、最初のリクエストで openpyxl の読み込みと
+        # スタイルの作成を待たないようにする
+        for future in [
+            self.executor.submit(azurerm2excel.named_styles)
+            for _ in range(self.jobs)
+        ]:
+            future.result()
+        return len(types)
+
+    def render(
+        self,
+        f,
+        output_format,
+        resource_filter,
+        output_folder,
+        link_ids=False,
+        rule_analysis=False,
+        compact=None,
+        inventory=False,
+    ):
+        resource_index = None
+        if link_ids and output_format == "xlsx":
+            resource_index = azurerm2excel.ResourceIndex()
+        inventory_rows = [] if inventory and output_format == "xlsx" else None
+        workbook_options = self.workbook_options._replace(
+            rule_analysis=rule_analysis, compact=compact
+        )
+        resources_by_type = azurerm2excel.group_resources_by_type(
+            f, resource_filter, resource_index, inventory_rows
+        )
+        with self.description_lock:
+            descriptions = self.description_cache.load(resources_by_type)
+        layouts = azurerm2excel.WorkbookLayouts(
+            resources_by_type, descriptions, workbook_options
+        )
+        links_by_type = {}
+        if resource_index is not None:
+            # ワーカーには、タイプが参照している ID のリンク先だけを渡す
+            links_by_type = {
+                resource_type: resource_index.link_targets(resource_type, layouts)
+                for resource_type in resources_by_type
+            }
+        futures = [
+            self.executor.submit(
+                azurerm2excel.write_resource_output,
+                output_format,
+                resource_type,
+                resources,
+                descriptions.get(resource_type, {}),
+                output_folder,
+                workbook_options,
+                links_by_type.get(resource_type),
+                layouts.get(resource_type),
+            )
+            for resource_type, resources in resources_by_type.items()
+        ]
+        results = [future.result() for future in futures]
+        if inventory_rows is not None:
+            for result in results:
+                layouts.setdefault(result["resource_type"], result["layout"])
+            azurerm2excel.write_inventory(
+                output_folder, inventory_rows, layouts, workbook_options
+            )
+        if output_format == "sqlite" and results:
+            azurerm2excel.index_sqlite_output(output_folder)
+        with self.requests_lock:
+            self.requests += 1
+        return results
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+
+class ParameterSheetHandler(BaseHTTPRequestHandler):
+    server_version = f"azurerm2excel/{azurerm2excel.__version__}"
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self.send_error(404)
+            return
+        server = self.server
+        body = json.dumps(
+            {
+                "version": azurerm2excel.__version__,
+                "description_types": len(server.description_cache.loaded_types),
+                "jobs": server.jobs,
+                "max_requests": server.max_requests,
+                "requests": server.requests,
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/workbook":
+            self.send_error(404)
+            return
+        start = time.perf_counter()
+        try:
+            with self.server.slots:
+                archive, filename, results = self.render(parse_qs(url.query))
+        except RequestError as e:
+            self.send_error(e.status, str(e))
+            return
+        except ValueError as e:  # 壊れた JSON など
+            self.send_error(400, f"invalid tfstate: {e}")
+            return
+        except Exception as e:
+            self.log_error("%s failed: %r", self.path, e)
+            self.send_error(500, str(e))
+            return
+        with archive:
+            size = archive.seek(0, os.SEEK_END)
+            archive.seek(0)
+            self.send_response(200)
+            content_type = CONTENT_TYPES[os.path.splitext(filename)[1]]
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(size))
+            self.send_header(
+                "Content-Disposition", f'attachment; filename="{filename}"'
+            )
+            self.send_header("X-Resource-Types", str(len(results)))
+            self.send_header("X-Render-Seconds", f"{time.perf_counter() - start:.3f}")
+            self.end_headers()
+            while True:
+                chunk = archive.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def render(self, query):
+        server = self.server
+        output_format = query.get("format", ["xlsx"])[0]
+        if output_format not in azurerm2excel.OUTPUT_FORMATS:
+            raise RequestError(400, f"unknown format: {output_format}")
+        resource_filter = request_filter(query)
+        link_ids = query.get("link_ids", ["0"])[0] == "1"
+        rule_analysis = query.get("rule_analysis", ["0"])[0] == "1"
+        compact = query.get("compact", [None])[0]
+        if compact is not None and compact not in azurerm2excel.COMPACT_MODES:
+            raise RequestError(400, f"unknown compact mode: {compact}")
+        inventory = query.get("inventory", ["0"])[0] == "1"
+        path = query.get("path", [None])[0]
+
+        with tempfile.TemporaryDirectory(prefix="azurerm2excel-") as output_folder:
+            if path is not None:
+                # サーバーから読めるファイルのパスを受け付ける (--allow-path のときだけ)
+                if not server.allow_path:
+                    raise RequestError(403, "path is not allowed (see --allow-path)")
+                if not os.path.isfile(path):
+                    raise RequestError(404, f"{path} does not exist")
+                with azurerm2excel.open_tfstate(path) as f:
+                    results = server.render(
+                        f,
+                        output_format,
+                        resource_filter,
+                        output_folder,
+                        link_ids,
+                        rule_analysis,
+                        compact,
+                        inventory,
+                    )
+            else:
+                length = self.headers.get("Content-Length")
+                if length is None:
+                    raise RequestError(411, "Content-Length is required")
+                raw = io.BufferedReader(RequestBody(self.rfile, int(length)))
+                with azurerm2excel.open_tfstate_stream(raw) as f:
+                    results = server.render(
+                        f,
+                        output_format,
+                        resource_filter,
+                        output_folder,
+                        link_ids,
+                        rule_analysis,
+                        compact,
+                        inventory,
+                    )
+                # 読み残したボディは捨てて、接続を次のリクエストに使えるようにする
+                while raw.read(1024 * 1024):
+                    pass
+
+            filenames = os.listdir(output_folder)
+            if len(filenames) == 1 and query.get("zip", ["0"])[0] != "1":
+                filename = filenames[0]
+                archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                with open(os.path.join(output_folder, filename), "rb") as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        archive.write(chunk)
+                archive.seek(0)
+            else:
+                filename = "parameter_sheets.zip"
+                archive = zip_outputs(output_folder)
+        return archive, filename, results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="説明を読み込んだまま常駐し、HTTP でパラメタシートを作成します"
+    )
+    parser.add_argument(
+        "description_folders", nargs="+", help="description folders (*.json)"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="bind address")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="worker processes shared by all requests (default 0: CPU count)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=0,
+        help="requests processed at the same time; others wait (default: --jobs)",
+    )
+    parser.add_argument(
+        "--description-index",
+        metavar="PATH",
+        help="SQLite index compiled from the description folders",
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="load every description and start the workers before serving",
+    )
+    parser.add_argument(
+        "--allow-path",
+        action="store_true",
+        help="accept ?path=<tfstate on the server> instead of an uploaded body",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        help="ZIP compression level of the xlsx files (0: no compression)",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or a positive number")
+    if args.max_requests == 0:
+        args.max_requests = args.jobs
+    if args.max_requests < 0:
+        parser.error("--max-requests must be 0 or a positive number")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for description_folder in args.description_folders:
+        if not os.path.isdir(description_folder):
+            print(f"Error: The directory {description_folder} does not exist。")
+            return 1
+
+    server = ParameterSheetServer(
+        (args.host, args.port),
+        args.description_folders,
+        jobs=args.jobs,
+        max_requests=args.max_requests,
+        description_index=args.description_index,
+        allow_path=args.allow_path,
+        workbook_options=azurerm2excel.DEFAULT_WORKBOOK_OPTIONS._replace(
+            compresslevel=args.compress_level
+        ),
+    )
+    with server:
+        if args.preload:
+            start = time.perf_counter()
+            count = server.preload()
+            print(
+                f"Preloaded {count} description types "
+                f"({time.perf_counter() - start:.1f}s)"
+            )
+        host, port = server.server_address[:2]
+        print(
+            f"Serving on http://{host}:{port}/workbook "
+            f"(jobs={args.jobs}, max_requests={args.max_requests})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# azurerm2excel.py はパッケージではないので、リポジトリのルートから import する
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,137 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import azurerm2excel
+
+
+class ShortReader:
+    # read(size) が最大 step 文字しか返さないファイル (チャンクの境界をあらゆる位置に置く)
+    def __init__(self, text, step):
+        self.text = text
+        self.step = step
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.text)
+        chunk = self.text[self.pos : self.pos + min(size, self.step)]
+        self.pos += len(chunk)
+        return chunk
+
+
+def make_state():
+    resources = []
+    for number in range(6):
+        resources.append(
+            {
+                "mode": "managed" if number % 3 else "data",
+                "type": "azurerm_subnet",
+                "name": f"snet{number}",
+                "module": f'module.net["k\\"{number}"]',
+                "instances": [
+                    {
+                        "index_key": number,
+                        "attributes": {
+                            "id": f"/subscriptions/0/snet{number}",
+                            "name": "名前 é \U0001f600 \\ \" \n \t",
+                            "address_prefixes": [f"10.0.{number}.0/24"],
+                            "count": 12345678901234567890 + number,
+                            "ratio": -1.5e-7 * number,
+                            "enabled": number % 2 == 0,
+                            "tags": {},
+                            "empty": [],
+                            "nothing": None,
+                            "nested": [{"a": [[1, 2], {"b": "}]{[,:"}]}],
+                        },
+                    }
+                ],
+            }
+        )
+    return {
+        "version": 4,
+        "terraform_version": "1.9.0",
+        "outputs": {"value": {"value": "]}", "type": "string"}},
+        "resources": resources,
+        "check_results": None,
+    }
+
+
+STATE = make_state()
+
+
+def stream_resources(text, step):
+    return list(azurerm2excel.iter_tfstate_resources(ShortReader(text, step)))
+
+
+@pytest.mark.parametrize("step", [1, 2, 3, 5, 7, 13, 64, 4096])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_matches_json_load_at_every_chunk_size(step, indent):
+    text = json.dumps(STATE, ensure_ascii=False, indent=indent)
+    assert stream_resources(text, step) == json.loads(text)["resources"]
+
+
+@pytest.mark.parametrize("step", [1, 3, 4096])
+def test_resources_before_other_keys(step):
+    state = {"resources": STATE["resources"], "outputs": STATE["outputs"]}
+    text = json.dumps(state, ensure_ascii=True, separators=(",", ":"))
+    assert stream_resources(text, step) == STATE["resources"]
+
+
+@pytest.mark.parametrize(
+    "text", ["{}", '{"version": 4}', '{"resources": []}', ' {\n"resources" : [ ] }\n']
+)
+def test_no_resources(text):
+    assert stream_resources(text, 1) == []
+
+
+def test_number_at_chunk_boundary():
+    # 数値の途中でチャンクが切れても、続きを読んでから値を確定する
+    text = '{"resources": [{"n": 1234567}, {"n": 0.25e10}]}'
+    for step in range(1, len(text) + 1):
+        assert stream_resources(text, step) == [{"n": 1234567}, {"n": 0.25e10}]
+
+
+def test_resource_filter_skips_before_yield():
+    resource_filter = azurerm2excel.ResourceFilter({"name": ["snet1", "snet4"]}, {})
+    text = json.dumps(STATE)
+    resources = list(
+        azurerm2excel.iter_tfstate_resources(ShortReader(text, 5), resource_filter)
+    )
+    assert [resource["name"] for resource in resources] == ["snet1", "snet4"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"resources": [{"a": 1}',
+        '{"resources": [{"a": 1} {"b": 2}]}',
+        '{"resources": [{"a": 1}]',
+        '{"resources" [] }',
+        '[{"a": 1}]',
+    ],
+)
+def test_broken_json_raises(text):
+    with pytest.raises(json.JSONDecodeError):
+        stream_resources(text, 2)
+
+
+def test_gzip_stream_matches_json_load():
+    text = json.dumps(STATE, ensure_ascii=False)
+    raw = io.BufferedReader(io.BytesIO(gzip.compress(text.encode("utf-8"))))
+    with azurerm2excel.open_tfstate_stream(raw) as f:
+        assert list(azurerm2excel.iter_tfstate_resources(f)) == STATE["resources"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 16, 1000])
+def test_values_larger_than_the_chunk_size(chunk_size):
+    # 読み込みサイズはバッファに合わせて大きくなり、大きなリソースも読み直しながら確定する
+    resource = {"attributes": {"value": "x" * 50000, "list": list(range(3000))}}
+    text = json.dumps({"resources": [resource, resource]})
+    stream = azurerm2excel._JsonStream(io.StringIO(text), chunk_size)
+    stream.expect("{")
+    assert stream.value() == "resources"
+    stream.expect(":")
+    assert stream.value() == [resource, resource]
@@ -0,0 +1,197 @@
+import json
+import os
+
+import pytest
+
+import azurerm2excel
+
+openpyxl = pytest.importorskip("openpyxl")
+
+SUBSCRIPTION = "/subscriptions/0/resourceGroups/rg/providers/Microsoft.Network"
+
+
+def subnet_id(number):
+    return f"{SUBSCRIPTION}/virtualNetworks/vnet/subnets/snet{number}"
+
+
+def resource(resource_type, name, attributes, module=None):
+    res = {
+        "mode": "managed",
+        "type": resource_type,
+        "name": name,
+        "instances": [{"attributes": attributes}],
+    }
+    if module:
+        res["module"] = module
+    return res
+
+
+def make_state():
+    resources = []
+    for number in range(6):
+        attributes = {
+            "id": subnet_id(number),
+            "name": f"snet{number}",
+            "address_prefixes": [f"10.0.{number}.0/24"],
+            "service_endpoints": [f"Microsoft.Service{i}" for i in range(8)],
+        }
+        if number == 3:
+            # 同じタイプの、別のブックにあるリソースへの参照
+            attributes["route_table_id"] = subnet_id(0).upper()
+        resources.append(resource("azurerm_subnet", f"snet{number}", attributes))
+    # 別のモジュールの同じ名前のリソース (シート名が重複する)
+    for key in ("a", "b"):
+        resources.append(
+            resource(
+                "azurerm_subnet",
+                "this",
+                {"id": f"{SUBSCRIPTION}/subnets/{key}", "name": f"this-{key}"},
+                module=f'module.spoke["{key}"]',
+            )
+        )
+    for number in range(6):
+        resources.append(
+            resource(
+                "azurerm_network_interface",
+                f"nic{number}",
+                {
+                    "id": f"{SUBSCRIPTION}/networkInterfaces/nic{number}",
+                    "ip_configuration": [
+                        {"name": "ipconfig", "subnet_id": subnet_id(5 - number)}
+                    ],
+                },
+            )
+        )
+    resources.append(
+        resource(
+            "azurerm_network_interface",
+            "nic_this",
+            {
+                "id": f"{SUBSCRIPTION}/networkInterfaces/nic_this",
+                "ip_configuration": [
+                    {"name": "ipconfig", "subnet_id": f"{SUBSCRIPTION}/subnets/b"}
+                ],
+            },
+        )
+    )
+    return {"version": 4, "resources": resources}
+
+
+def linked_cells(output_folder):
+    for filename in sorted(os.listdir(output_folder)):
+        if not filename.endswith(".xlsx"):
+            continue
+        wb = openpyxl.load_workbook(os.path.join(output_folder, filename))
+        for ws in wb.worksheets:
+            for row in ws.iter_rows():
+                for cell in row:
+                    if cell.hyperlink is not None:
+                        yield filename, ws.title, cell
+
+
+def sheet_id(output_folder, filename, location):
+    # location は 'sheet'!A1。リンク先のシートの id 行の値を返す
+    sheet_title = location.rsplit("!", 1)[0][1:-1].replace("''", "'")
+    wb = openpyxl.load_workbook(os.path.join(output_folder, filename))
+    assert sheet_title in wb.sheetnames, (filename, sheet_title)
+    for path, value, *_ in wb[sheet_title].iter_rows(values_only=True):
+        if path == "id":
+            return value
+
+
+@pytest.mark.parametrize(
+    "max_workbook_rows, max_memory_mb, jobs",
+    [(None, None, 1), (1, None, 1), (10, None, 2), (None, 1, 4)],
+)
+def test_links_point_to_the_sheet_of_the_referenced_resource(
+    tmp_path, max_workbook_rows, max_memory_mb, jobs
+):
+    tfstate = tmp_path / "terraform.tfstate"
+    tfstate.write_text(json.dumps(make_state()), encoding="utf-8")
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    options = azurerm2excel.DEFAULT_WORKBOOK_OPTIONS._replace(
+        max_workbook_rows=max_workbook_rows
+    )
+    azurerm2excel.process_tfstates(
+        [str(tfstate)],
+        [],
+        str(output_folder),
+        jobs,
+        workbook_options=options,
+        link_ids=True,
+        max_memory_mb=max_memory_mb,
+    )
+    if max_workbook_rows or max_memory_mb:
+        assert os.path.isfile(output_folder / "azurerm_subnet_2.xlsx")
+
+    links = list(linked_cells(output_folder))
+    assert len(links) == 2 * 8  # 参照している 8 つの属性ごとに値と Reference の2セル
+    for filename, title, cell in links:
+        target = cell.hyperlink.target or filename
+        target_id = sheet_id(output_folder, target, cell.hyperlink.location)
+        if cell.column == 2:
+            # 値の列: リンク先のシートの id と同じ ID (大文字小文字は区別しない)
+            assert target_id.lower() == cell.value.lower()
+        else:
+            assert target_id
+        # 同じブックへのリンクはファイル名を付けない
+        assert cell.hyperlink.target != filename
+
+
+def inventory_links(output_folder):
+    wb = openpyxl.load_workbook(os.path.join(output_folder, "inventory.xlsx"))
+    for ws in wb.worksheets:
+        rows = ws.iter_rows(min_row=2)
+        for resource_type, module, name, *_, workbook, sheet in rows:
+            yield resource_type.value, module.value, name.value, workbook, sheet
+
+
+@pytest.mark.parametrize(
+    "max_workbook_rows, max_memory_mb, jobs",
+    [(None, None, 1), (1, None, 1), (10, None, 2), (None, 1, 4)],
+)
+def test_inventory_links_to_the_sheet_of_each_resource(
+    tmp_path, capsys, max_workbook_rows, max_memory_mb, jobs
+):
+    state = make_state()
+    # XML で使えない制御文字は取り除く
+    state["resources"][7]["module"] = 'module.spoke["b\x01"]'
+    tfstate = tmp_path / "terraform.tfstate"
+    tfstate.write_text(json.dumps(state), encoding="utf-8")
+    expected_ids = {}
+    for res in state["resources"]:
+        module = res.get("module", "").replace("\x01", "") or None
+        expected_ids[module, res["name"]] = res["instances"][0]["attributes"]["id"]
+    options = azurerm2excel.DEFAULT_WORKBOOK_OPTIONS._replace(
+        max_workbook_rows=max_workbook_rows, max_sheet_rows=5
+    )
+    # 2回目は --incremental で前回のブックを流用し、流用したブックのシートにリンクする
+    for run in ("20260101_000000", "20260101_000001"):
+        output_folder = tmp_path / "runs" / run
+        output_folder.mkdir(parents=True)
+        azurerm2excel.process_tfstates(
+            [str(tfstate)],
+            [],
+            str(output_folder),
+            jobs,
+            incremental=True,
+            workbook_options=options,
+            max_memory_mb=max_memory_mb,
+            inventory=True,
+        )
+        links = list(inventory_links(output_folder))
+        assert len(links) == len(state["resources"])
+        assert links[7][1] == 'module.spoke["b"]'
+        for resource_type, module, name, workbook, sheet in links:
+            assert workbook.hyperlink.location == sheet.hyperlink.location
+            assert workbook.hyperlink.target == workbook.value == sheet.hyperlink.target
+            assert workbook.value.startswith(resource_type)
+            target_id = sheet_id(output_folder, workbook.value, sheet.hyperlink.location)
+            assert target_id == expected_ids[module, name]
+    # 2回目はすべてのタイプを流用し、一覧は続きのシートに分ける
+    assert "reused=2" in capsys.readouterr().out.splitlines()[-2]
+    assert openpyxl.load_workbook(output_folder / "inventory.xlsx").sheetnames[:2] == [
+        "inventory",
+        "inventory (2)",
+    ]
@@ -0,0 +1,304 @@
+import ipaddress
+import random
+
+import pytest
+
+import azurerm2excel
+from azurerm2excel import (
+    ADDRESS_RANGES,
+    PORT_RANGES,
+    Rule,
+    analyze_rules,
+    parse_address_interval,
+    parse_port_interval,
+    rule_values,
+)
+
+PROTOCOLS = ["*", "Tcp", "Udp", "Icmp"]
+ADDRESSES = [
+    "*",
+    "Any",
+    "VirtualNetwork",
+    "Internet",
+    "10.0.0.0/8",
+    "10.1.0.0/16",
+    "10.1.2.0/24",
+    "10.1.2.3",
+    "10.1.3.0/24",
+    "10.0.0.0-10.1.255.255",
+    "192.168.0.0/16",
+    "0.0.0.0/0",
+    "2001:db8::/32",
+    "2001:db8::1",
+    "::/0",
+]
+PORTS = ["*", "22", "80", "443", "80-443", "1000-2000", "1500", "0-65535"]
+
+
+def covers(earlier, later):
+    # earlier の条件が later の条件をすべて含むか (RuleFieldIndex.covering の定義どおり)
+    if earlier.wildcard:
+        return True
+    if later.wildcard:
+        return False
+    if not later.tokens <= earlier.tokens:
+        return False
+    return all(
+        any(low <= first and last <= high for low, high in earlier.intervals)
+        for first, last in later.intervals
+    )
+
+
+def overlaps(earlier, later):
+    if earlier.wildcard or later.wildcard:
+        return True
+    if earlier.tokens & later.tokens:
+        return True
+    return any(
+        low <= last and first <= high
+        for low, high in earlier.intervals
+        for first, last in later.intervals
+    )
+
+
+def brute_force(rules):
+    # 先に評価されるすべてのルールと1組ずつ比べる
+    findings = []
+    for position, rule in enumerate(rules):
+        earlier = rules[:position]
+        duplicates = [other for other in earlier if other.fields == rule.fields]
+        if duplicates:
+            findings.append((rule, "duplicate", duplicates[0], 1))
+            continue
+        covering = [
+            other
+            for other in earlier
+            if all(map(covers, other.fields, rule.fields))
+        ]
+        if covering:
+            findings.append((rule, "shadowed", covering[0], len(covering)))
+            continue
+        overlapping = [
+            other
+            for other in earlier
+            if other.action.lower() != rule.action.lower()
+            and all(map(overlaps, other.fields, rule.fields))
+        ]
+        if overlapping:
+            findings.append((rule, "overlapping", overlapping[0], len(overlapping)))
+    return findings
+
+
+def random_rule(rng, number):
+    def pick(values):
+        return rng.sample(values, rng.choice([1, 1, 1, 2]))
+
+    fields = (
+        rule_values(pick(PROTOCOLS)),
+        rule_values(pick(ADDRESSES), parse_address_interval, ADDRESS_RANGES),
+        rule_values(pick(PORTS), parse_port_interval, PORT_RANGES),
+        rule_values(pick(ADDRESSES), parse_address_interval, ADDRESS_RANGES),
+        rule_values(pick(PORTS), parse_port_interval, PORT_RANGES),
+    )
+    return Rule(
+        f"security_rule{number}",
+        "Inbound",
+        100 + number,
+        f"rule{number}",
+        rng.choice(["Allow", "Deny", "allow"]),
+        fields,
+    )
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    rules = [random_rule(rng, number) for number in range(rng.randint(1, 80))]
+    # 同じ条件のルールを混ぜて重複も確認する
+    for _ in range(rng.randint(0, 5)):
+        rule = rng.choice(rules)
+        rules.insert(rng.randrange(len(rules) + 1), rule._replace(name="copy"))
+    assert analyze_rules(rules) == brute_force(rules)
+
+
+def test_more_rules_than_bits_in_a_machine_word():
+    rng = random.Random(1234)
+    rules = [random_rule(rng, number) for number in range(300)]
+    assert analyze_rules(rules) == brute_force(rules)
+
+
+def test_shadowed_overlapping_and_duplicate():
+    def rule(number, action, source, port):
+        return Rule(
+            f"security_rule{number}",
+            "Inbound",
+            number,
+            f"rule{number}",
+            action,
+            (
+                rule_values(["Tcp"]),
+                rule_values([source], parse_address_interval, ADDRESS_RANGES),
+                rule_values([port], parse_port_interval, PORT_RANGES),
+            ),
+        )
+
+    rules = [
+        rule(100, "Deny", "10.0.0.0/8", "*"),
+        rule(110, "Allow", "10.1.0.0/16", "443"),
+        rule(120, "Allow", "0.0.0.0/0", "80-443"),
+        rule(130, "Allow", "0.0.0.0/0", "80-443"),
+    ]
+    findings = [
+        (rule.priority, kind, related.priority, count)
+        for rule, kind, related, count in analyze_rules(rules)
+    ]
+    assert findings == [
+        (110, "shadowed", 100, 1),
+        (120, "overlapping", 100, 1),
+        (130, "duplicate", 120, 1),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["10.1.2.3", "10.1.2.0/24", "10.1.2.3/24", "0.0.0.0/0", "255.255.255.255/32"],
+)
+def test_ipv4_fast_path_matches_ipaddress(text):
+    network = ipaddress.ip_network(text, strict=False)
+    assert parse_address_interval(text) == (
+        int(network.network_address),
+        int(network.broadcast_address),
+    )
+
+
+def test_address_intervals():
+    assert parse_address_interval("10.0.0.1-10.0.0.9") == (0x0A000001, 0x0A000009)
+    low, high = parse_address_interval("2001:db8::/32")
+    assert low == azurerm2excel.IPV6_OFFSET + int(ipaddress.ip_address("2001:db8::"))
+    assert high - low == (1 << 96) - 1
+    assert parse_address_interval("VirtualNetwork") is None
+    assert parse_address_interval("10.0.0.1-2001:db8::1") is None
+    assert parse_address_interval("300.1.1.1") is None
+
+
+def test_merge_intervals_joins_adjacent_ranges():
+    assert azurerm2excel.merge_intervals([(80, 80), (81, 90), (10, 20), (15, 30)]) == (
+        (10, 30),
+        (80, 90),
+    )
+
+
+def application_rule(name, destination_addresses, terminate_tls=False, headers=()):
+    return {
+        "name": name,
+        "description": None,
+        "destination_addresses": destination_addresses,
+        "destination_fqdn_tags": [],
+        "destination_fqdns": [],
+        "destination_urls": [],
+        "http_headers": [{"name": key, "value": "1"} for key in headers],
+        "protocols": [{"type": "Https", "port": 443}],
+        "source_addresses": ["10.0.0.0/8"],
+        "source_ip_groups": [],
+        "terminate_tls": terminate_tls,
+        "web_categories": [],
+    }
+
+
+def application_findings(*collections):
+    # tfstate と同じリソースから、ネストしたブロックの行を作ってルールを組み立てる
+    resource = {
+        "type": "azurerm_firewall_policy_rule_collection_group",
+        "name": "group",
+        "instances": [
+            {
+                "attributes": {
+                    "name": "group",
+                    "priority": 100,
+                    "application_rule_collection": [
+                        {
+                            "name": f"col{number}",
+                            "priority": 100 * (number + 1),
+                            "action": action,
+                            "rule": [rule],
+                        }
+                        for number, (action, rule) in enumerate(collections)
+                    ],
+                }
+            }
+        ],
+    }
+    nested_rows = azurerm2excel.write_nested_tables(
+        azurerm2excel.WorkbookBuffer(),
+        azurerm2excel.COMPILED_NESTED_TABLES[resource["type"]],
+        azurerm2excel.flatten_resource(resource),
+        "group",
+    )
+    rules = azurerm2excel.firewall_policy_rules(nested_rows)["application"]
+    return [
+        (rule.name, kind, related.name)
+        for rule, kind, related, _ in analyze_rules(rules)
+    ]
+
+
+def test_application_rules_compare_destination_addresses():
+    assert (
+        application_findings(
+            ("Allow", application_rule("a", ["10.1.0.0/16"])),
+            ("Deny", application_rule("b", ["192.168.0.0/16"])),
+        )
+        == []
+    )
+    assert application_findings(
+        ("Allow", application_rule("a", ["10.0.0.0/8"])),
+        ("Deny", application_rule("b", ["10.1.0.0/16"])),
+    ) == [("col1/b", "shadowed", "col0/a")]
+
+
+def test_application_rules_with_other_options_are_not_duplicates():
+    assert application_findings(
+        ("Allow", application_rule("a", ["10.1.0.0/16"])),
+        ("Allow", application_rule("b", ["10.1.0.0/16"])),
+    ) == [("col1/b", "duplicate", "col0/a")]
+    for options in ({"terminate_tls": True}, {"headers": ["X-Test"]}):
+        assert application_findings(
+            ("Allow", application_rule("a", ["10.1.0.0/16"])),
+            ("Allow", application_rule("b", ["10.1.0.0/16"], **options)),
+        ) == [("col1/b", "shadowed", "col0/a")]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_index_matches_brute_force(seed):
+    # 区間が MASK_LEAVES より十分多く、ビットマスクを持つ部分木も使われる
+    rng = random.Random(seed)
+    rule_intervals = []
+    for _ in range(rng.randint(50, 300)):
+        intervals = []
+        for _ in range(rng.randint(1, 10)):
+            low = rng.randrange(1000)
+            intervals.append((low, low + rng.choice([0, 0, 3, 50, 400])))
+        rule_intervals.append(azurerm2excel.merge_intervals(intervals))
+    index = azurerm2excel.IntervalIndex(rule_intervals)
+
+    def rules(matches):
+        return sum(
+            1 << position
+            for position, intervals in enumerate(rule_intervals)
+            if any(matches(first, last) for first, last in intervals)
+        )
+
+    queries = [interval for intervals in rule_intervals for interval in intervals]
+    queries = rng.sample(queries, min(len(queries), 300))
+    queries += [(low, low + rng.randrange(300)) for low in range(0, 1400, 7)]
+    for low, high in queries:
+        assert index.covering(low, high) == rules(
+            lambda first, last: first <= low and high <= last
+        )
+        assert index.overlapping(low, high) == rules(
+            lambda first, last: first <= high and low <= last
+        )
+
+
+def test_interval_index_without_intervals():
+    index = azurerm2excel.IntervalIndex([(), ()])
+    assert index.covering(0, 10) == index.overlapping(0, 10) == 0